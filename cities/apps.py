@@ -1,6 +1,14 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_save, post_delete
 
 
 class CitiesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'cities'
+
+    def ready(self):
+        from cities.cache import invalidate_city
+        from cities.models import City
+
+        post_save.connect(invalidate_city, sender=City)
+        post_delete.connect(invalidate_city, sender=City)
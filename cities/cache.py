@@ -0,0 +1,107 @@
+import threading
+from collections import OrderedDict
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+
+from cities.models import City
+from utils.metrics import increment
+
+
+def city_key(name: str, county: str, state: str) -> tuple:
+    return name, county, state
+
+
+class CityCache:
+    """
+    Process-local LRU cache of cities by (name, county, state), loaded lazily from database. Cities with the same
+    name, county and state are matched by coordinates with CITY_COORDINATES_TOLERANCE degrees tolerance,
+    at most CITY_CACHE_SIZE keys are kept. Entries are invalidated by City post_save and post_delete signals
+    (see CitiesConfig.ready), so changes done by this process are visible right away.
+    Other processes see new cities when they do not find a matching cached one.
+    Cities read in a transaction are cached only when it is committed, so cities created by a transaction
+    that is rolled back never get into the cache.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.cities = OrderedDict()
+
+    def _cities(self, key: tuple) -> list:
+        with self.lock:
+            cities = self.cities.get(key)
+            if cities is not None:
+                self.cities.move_to_end(key)
+                increment('cities.cache.hit')
+                return cities
+
+        increment('cities.cache.miss')
+        name, county, state = key
+        cities = list(City.objects.filter(name=name, county=county, state=state).order_by('city_id'))
+        if cities:
+            # missing cities are not cached, they may be created by other processes
+            transaction.on_commit(lambda: self._store(key, cities))
+        return cities
+
+    def _store(self, key: tuple, cities: list) -> None:
+        with self.lock:
+            self.cities[key] = cities
+            self.cities.move_to_end(key)
+            while len(self.cities) > settings.CITY_CACHE_SIZE:
+                self.cities.popitem(last=False)
+
+    def find(self, name: str, county: str, state: str, lat=None, lng=None) -> City or None:
+        """
+        Returns city with given name, county and state, if lat and lng are given the city has to be within tolerance
+        of them. If there are more such cities, the first created one is returned.
+        """
+        cities = self._cities(city_key(name, county, state))
+        if lat is None or lng is None:
+            return cities[0] if cities else None
+
+        tolerance = Decimal(str(settings.CITY_COORDINATES_TOLERANCE))
+        lat, lng = Decimal(str(lat)), Decimal(str(lng))
+        for city in cities:
+            if abs(city.lat - lat) <= tolerance and abs(city.lng - lng) <= tolerance:
+                return city
+        return None
+
+    def resolve(self, city_data: dict) -> City:
+        """
+        Returns city matching city_data (see find), the city is created if there is no such city.
+        Concurrent creation of the same city is handled by get_or_create, which falls back to get
+        when city_unique_location constraint is violated.
+
+        :param city_data: dictionary with name, county, state, lat and lng of the city
+        :return: found or created city
+        """
+        city = self.find(city_data['name'], city_data['county'], city_data['state'], city_data['lat'], city_data['lng'])
+        if city is None:
+            city, _ = City.objects.get_or_create(**city_data)
+        return city
+
+    def invalidate(self, city: City) -> None:
+        with self.lock:
+            self.cities.pop(city_key(city.name, city.county, city.state), None)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.cities.clear()
+
+
+city_cache = CityCache()
+
+
+def _invalidate(city: City, created: bool) -> None:
+    if created:
+        city_cache.invalidate(city)
+    else:
+        # updated city may have been cached under its previous name
+        city_cache.clear()
+
+
+def invalidate_city(sender, instance, created: bool = True, **kwargs):
+    _invalidate(instance, created)
+    # cities read earlier in the same transaction are cached on commit, so they are invalidated again after them
+    transaction.on_commit(lambda: _invalidate(instance, created))
@@ -0,0 +1,40 @@
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+LOCATION_FIELDS = ('name', 'county', 'state', 'lat', 'lng')
+
+
+def merge_duplicate_cities(apps, schema_editor):
+    """
+    Points rides and recurrent rides using duplicated cities to the first created one and deletes the duplicates,
+    so the unique constraint can be added.
+    """
+    City = apps.get_model('cities', 'City')
+    duplicates = City.objects.values(*LOCATION_FIELDS).annotate(kept_id=Min('city_id'), cities=Count('city_id')) \
+        .filter(cities__gt=1)
+    for duplicate in duplicates:
+        location = {field: duplicate[field] for field in LOCATION_FIELDS}
+        duplicate_ids = list(City.objects.filter(**location).exclude(city_id=duplicate['kept_id'])
+                             .values_list('city_id', flat=True))
+        for relation in City._meta.related_objects:
+            relation.related_model._base_manager.filter(**{f'{relation.field.name}__in': duplicate_ids}) \
+                .update(**{relation.field.name: duplicate['kept_id']})
+        City.objects.filter(city_id__in=duplicate_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cities', '0004_alter_city_lat_alter_city_lng'),
+        ('rides', '0006_ride_route_points'),
+        ('recurrent_rides', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_cities, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='city',
+            constraint=models.UniqueConstraint(fields=('name', 'county', 'state', 'lat', 'lng'),
+                                               name='city_unique_location'),
+        ),
+    ]
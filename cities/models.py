@@ -8,3 +8,8 @@ class City(models.Model):
     state = models.CharField(max_length=100)
     lat = models.DecimalField(null=False, max_digits=15, decimal_places=7)
     lng = models.DecimalField(null=False, max_digits=15, decimal_places=7)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['name', 'county', 'state', 'lat', 'lng'], name='city_unique_location'),
+        ]
@@ -1,5 +1,6 @@
 from rest_framework import serializers
 
+from cities.cache import city_cache
 from cities.models import City
 
 
@@ -9,5 +10,4 @@ class CitySerializer(serializers.ModelSerializer):
         fields = ('city_id', 'name', 'county', 'state', 'lat', 'lng')
 
     def create(self, validated_data):
-        instance, _ = City.objects.get_or_create(**validated_data)
-        return instance
+        return city_cache.resolve(validated_data)
@@ -4,6 +4,8 @@ from datetime import timedelta
 import pandas as pd
 from django.contrib.postgres.fields import ArrayField
 from django.db import models
+from django.db.models import F
+from django.utils import timezone
 from pandas import DatetimeIndex
 
 from cities.models import City
@@ -86,7 +88,8 @@ def create_or_update_single_rides(recurrent_ride: RecurrentRide) -> None:
 
     if recurrent_ride.single_rides.exists():
         recurrent_ride.single_rides.filter(**{"is_cancelled": False,
-                                              "start_date__gt": datetime.datetime.today()}).update(**data)
+                                              "start_date__gt": datetime.datetime.today()}).update(
+            version=F('version') + 1, updated_at=timezone.now(), **data)
     else:
         for start_date in dates:
             data['start_date'] = start_date
@@ -1,6 +1,5 @@
 import datetime
 
-from django.http import JsonResponse
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.filters import OrderingFilter
@@ -11,15 +10,17 @@ from recurrent_rides.filters import RecurrentRideFilter
 from recurrent_rides.models import RecurrentRide
 from recurrent_rides.serializers import RecurrentRideSerializer, RecurrentRidePersonal, SingleRideSerializer
 from rides.models import Ride
+from utils.authentication import TokenAuthenticatedMixin
 from utils.CustomPagination import CustomPagination
 from utils.generic_endpoints import get_paginated_queryset
+from utils.idempotency import idempotent
+from utils.renderers import JsonResponse
 from utils.services import create_or_update_ride, update_partial_ride, cancel_ride
 from utils.utils import is_user_a_driver, filter_rides_by_cities
-from utils.validate_token import validate_token
 
 
 # Create your views here.
-class RecurrentRideViewSet(viewsets.ModelViewSet):
+class RecurrentRideViewSet(TokenAuthenticatedMixin, viewsets.ModelViewSet):
     serializer_classes = {
         'create': RecurrentRideSerializer,
         'update': RecurrentRideSerializer,
@@ -31,6 +32,7 @@ class RecurrentRideViewSet(viewsets.ModelViewSet):
     filter_backends = [filters.DjangoFilterBackend, OrderingFilter]
     filterset_class = RecurrentRideFilter
     pagination_class = CustomPagination
+    public_actions = ('list', 'retrieve')
     ordering_fields = ['price', 'start_date', 'duration']
 
     def get_serializer_class(self):
@@ -47,9 +49,9 @@ class RecurrentRideViewSet(viewsets.ModelViewSet):
 
         return JsonResponse(status=status_code, data=message, safe=False)
 
-    @validate_token
+    @idempotent
     def create(self, request, *args, **kwargs):
-        user = kwargs['user']
+        user = request.user
 
         response = self._create_new_recurrent_ride(request=request, user=user)
         return response
@@ -70,15 +72,13 @@ class RecurrentRideViewSet(viewsets.ModelViewSet):
             return JsonResponse(status=status.HTTP_405_METHOD_NOT_ALLOWED, data="User not allowed to update a ride",
                                 safe=False)
 
-    @validate_token
     def update(self, request, *args, **kwargs):
-        user = kwargs['user']
+        user = request.user
 
         return self._update_recurrent_ride(request=request, user=user)
 
-    @validate_token
     def destroy(self, request, *args, **kwargs):
-        user = kwargs['user']
+        user = request.user
 
         instance = self.get_object()
         if instance.driver == user:
@@ -100,7 +100,6 @@ class RecurrentRideViewSet(viewsets.ModelViewSet):
         filtered_rides = self.filter_queryset(rides)
         return get_paginated_queryset(self, filtered_rides)
 
-    @validate_token
     @action(detail=False, methods=['get'])
     def user_rides(self, request, *args, **kwargs):
         """
@@ -108,7 +107,7 @@ class RecurrentRideViewSet(viewsets.ModelViewSet):
         :param request:
         :return: List of user's recurrent rides.
         """
-        user = kwargs['user']
+        user = request.user
 
         return self._get_user_rides(request, user)
 
@@ -127,8 +126,7 @@ class RecurrentRideViewSet(viewsets.ModelViewSet):
             return JsonResponse(status=status.HTTP_405_METHOD_NOT_ALLOWED, data="User not allowed to get rides",
                                 safe=False)
 
-    @validate_token
     @action(detail=True, methods=['get'])
     def single_rides(self, request, *args, **kwargs):
-        user = kwargs['user']
+        user = request.user
         return self._get_singular_rides(request, user)
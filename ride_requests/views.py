@@ -1,7 +1,6 @@
 import datetime
 
 from django.db.models import QuerySet
-from django.http import JsonResponse
 from django_filters import rest_framework as filters
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
@@ -11,22 +10,26 @@ from ride_requests.selectors import requests_list
 from rides_microservice import tasks
 from rides.models import Participation, Ride
 from rides.serializers import ParticipationSerializer
+from utils.authentication import TokenAuthenticatedMixin
+from utils.conditional import conditional_get
 from utils.CustomPagination import CustomPagination
 from utils.generic_endpoints import get_paginated_queryset
+from utils.idempotency import idempotent
+from utils.renderers import JsonResponse
 from utils.utils import verify_request
-from utils.validate_token import validate_token
-from rides_microservice.celery import queue_notify, queue_reviews
 
 
 # Create your views here.
-class RequestViewSet(viewsets.ModelViewSet):
+class RequestViewSet(TokenAuthenticatedMixin, viewsets.ModelViewSet):
     queryset = Participation.objects.filter(ride__is_cancelled=False, ride__start_date__gt=datetime.datetime.today())
     filter_backends = [filters.DjangoFilterBackend, RequestOrderFilter]
     filterset_class = RequestFilter
     pagination_class = CustomPagination
+    # update and partial_update were never protected by token, kept unchanged
+    public_actions = ('list', 'retrieve', 'update', 'partial_update')
     serializer_class = ParticipationSerializer
 
-    @validate_token
+    @idempotent
     def create(self, request, pk=None, *args, **kwargs):
         """
         Endpoint for sending request to join a ride.
@@ -34,7 +37,7 @@ class RequestViewSet(viewsets.ModelViewSet):
         :param pk:
         :return:
         """
-        user = kwargs['user']
+        user = request.user
 
         if not user.private:
             return JsonResponse(status=status.HTTP_405_METHOD_NOT_ALLOWED,
@@ -57,13 +60,11 @@ class RequestViewSet(viewsets.ModelViewSet):
 
             participation = Participation.objects.create(ride=ride, user=user, decision=decision,
                                                          reserved_seats=seats_no)
-            tasks.publish_message(ParticipationSerializer(participation).data, 'participation', queue_notify, 'notify')
-            # tasks.publish_message(ParticipationSerializer(participation).data, 'participation', queue_reviews, 'review')
+            tasks.publish_fanout(ParticipationSerializer(participation).data, 'participation', ['notify'])
             return JsonResponse(status=status.HTTP_200_OK, data='Request successfully sent', safe=False)
         else:
             return JsonResponse(status=status.HTTP_400_BAD_REQUEST, data=message, safe=False)
 
-    @validate_token
     @action(detail=True, methods=['post'])
     def decision(self, request, *args, **kwargs):
         """
@@ -74,7 +75,7 @@ class RequestViewSet(viewsets.ModelViewSet):
         :return:
         """
 
-        user = kwargs['user']
+        user = request.user
 
         instance = self.get_object()
 
@@ -87,10 +88,7 @@ class RequestViewSet(viewsets.ModelViewSet):
                         instance.decision = decision
                         instance.save()
 
-                        tasks.publish_message(ParticipationSerializer(instance).data, 'participation',
-                                              queue_notify, 'notify')
-                        # tasks.publish_message(ParticipationSerializer(instance).data, 'participation',
-                        #                       queue_reviews, 'review')
+                        tasks.publish_fanout(ParticipationSerializer(instance).data, 'participation', ['notify'])
 
                         return JsonResponse(status=status.HTTP_200_OK,
                                             data=f'Request successfully changed to {decision}', safe=False)
@@ -104,14 +102,13 @@ class RequestViewSet(viewsets.ModelViewSet):
         else:
             return JsonResponse(status=status.HTTP_405_METHOD_NOT_ALLOWED, data="User not allowed", safe=False)
 
-    @validate_token
     def destroy(self, request, *args, **kwargs):
         """
         Endpoint for removing sent requests
         :param request:
         :return:
         """
-        user = kwargs['user']
+        user = request.user
 
         instance = self.get_object()
 
@@ -120,10 +117,7 @@ class RequestViewSet(viewsets.ModelViewSet):
                 instance.decision = Participation.Decision.CANCELLED
                 instance.save()
 
-                tasks.publish_message(ParticipationSerializer(instance).data, 'participation', queue_notify,
-                                      'notify')
-                tasks.publish_message(ParticipationSerializer(instance).data, 'participation', queue_reviews,
-                                      'review')
+                tasks.publish_fanout(ParticipationSerializer(instance).data, 'participation', ['notify', 'review'])
 
                 return JsonResponse(status=status.HTTP_200_OK, data=f'Request successfully cancelled', safe=False)
 
@@ -138,12 +132,12 @@ class RequestViewSet(viewsets.ModelViewSet):
                                  filters=additional_filters)
         filtered_requests = self.filter_queryset(requests)
 
-        return get_paginated_queryset(self, filtered_requests)
+        return conditional_get(request, filtered_requests, lambda: get_paginated_queryset(self, filtered_requests),
+                               prefix='ride__', etag_parts=(request.user.pk,))
 
-    @validate_token
     @action(detail=False, methods=['get'])
     def my_requests(self, request, *args, **kwargs):
-        user = kwargs['user']
+        user = request.user
 
         rides = Ride.objects.filter(passengers=user,
                                     **{"is_cancelled": False, "start_date__gt": datetime.datetime.today()})
@@ -152,10 +146,9 @@ class RequestViewSet(viewsets.ModelViewSet):
         return self._get_requests_list(request=request, rides=rides, decision=decision,
                                        additional_filters=participation_filters)
 
-    @validate_token
     @action(detail=False, methods=['get'])
     def pending_requests(self, request, *args, **kwargs):
-        user = kwargs['user']
+        user = request.user
 
         rides = Ride.objects.filter(driver=user, **{"is_cancelled": False, "start_date__gt": datetime.datetime.today()})
         return self._get_requests_list(request=request, rides=rides, decision='pending')
@@ -0,0 +1,57 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from rides.models import TimetableImport
+from users.models import User
+from utils.imports import claim_import, file_format, run_import
+
+
+class Command(BaseCommand):
+    help = 'Imports rides of company user from timetable file (CSV or JSONL) or resumes failed import.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', help='timetable file')
+        parser.add_argument('--user', help='email of company user the rides belong to')
+        parser.add_argument('--format', choices=TimetableImport.Format.values,
+                            help='file format, by default taken from file extension')
+        parser.add_argument('--batch-size', type=int, help='number of rows inserted at once')
+        parser.add_argument('--resume', type=int, metavar='IMPORT_ID',
+                            help='resume import with given id, also when it was left running by a killed process')
+
+    def handle(self, *args, **options):
+        if options['resume'] is not None:
+            timetable_import = claim_import(options['resume'], statuses=(TimetableImport.Status.PENDING,
+                                                                         TimetableImport.Status.RUNNING,
+                                                                         TimetableImport.Status.FAILED))
+            if timetable_import is None:
+                raise CommandError(f"Import {options['resume']} does not exist or is completed")
+        else:
+            timetable_import = self._create_import(options)
+            timetable_import = claim_import(timetable_import.pk)
+
+        self.stdout.write(f'Importing {timetable_import.path} (import {timetable_import.pk}) '
+                          f'from row {timetable_import.processed_rows}')
+        run_import(timetable_import, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Created {timetable_import.created_rides} rides, '
+                                             f'{timetable_import.failed_rows} rows failed'))
+        for error in timetable_import.errors:
+            self.stdout.write(f"Row {error['index']}: {error['errors']}")
+
+    @staticmethod
+    def _create_import(options) -> TimetableImport:
+        if not options['path'] or not options['user']:
+            raise CommandError('Path and --user are required for a new import')
+        try:
+            user = User.objects.get(email=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f"User {options['user']} does not exist")
+        if user.private:
+            raise CommandError('Only company users can import timetables')
+
+        import_format = options['format'] or file_format(options['path'])
+        if import_format is None:
+            raise CommandError('Unknown file format, use --format')
+        # file is imported in place, so it has to be kept until the import is completed
+        return TimetableImport.objects.create(user=user, path=os.path.abspath(options['path']),
+                                              format=import_format)
@@ -0,0 +1,21 @@
+# Generated by Django 4.1.1 on 2026-10-19 13:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rides', '0002_ride_was_archived'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ride',
+            index=models.Index(condition=models.Q(('was_archived', False)), fields=['start_date'], name='ride_current_start_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ride',
+            index=models.Index(condition=models.Q(('is_cancelled', False), ('was_archived', False)), fields=['city_to', 'start_date'], name='ride_current_city_to_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.1.1 on 2026-10-19 14:02
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rides', '0003_current_ride_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ride',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='ride',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,55 @@
+from itertools import groupby
+
+from django.db import migrations, models
+
+from utils import polyline
+
+BATCH_SIZE = 1000
+
+
+def coordinates_to_route(apps, schema_editor):
+    Ride = apps.get_model('rides', 'Ride')
+    Coordinate = apps.get_model('rides', 'Coordinate')
+
+    coordinates = Coordinate.objects.filter(ride__isnull=False).order_by('ride_id', 'sequence_no', 'coordinate_id')
+    rides = []
+    for ride_id, points in groupby(coordinates.values_list('ride_id', 'lat', 'lng').iterator(chunk_size=BATCH_SIZE),
+                                   key=lambda point: point[0]):
+        rides.append(Ride(ride_id=ride_id, route=polyline.encode((lat, lng) for _, lat, lng in points)))
+        if len(rides) == BATCH_SIZE:
+            Ride.objects.bulk_update(rides, ['route'])
+            rides = []
+    Ride.objects.bulk_update(rides, ['route'])
+
+
+def route_to_coordinates(apps, schema_editor):
+    Ride = apps.get_model('rides', 'Ride')
+    Coordinate = apps.get_model('rides', 'Coordinate')
+
+    coordinates = []
+    for ride_id, route in Ride.objects.exclude(route='').values_list('ride_id', 'route').iterator(chunk_size=BATCH_SIZE):
+        coordinates.extend(Coordinate(ride_id=ride_id, lat=lat, lng=lng, sequence_no=sequence_no)
+                           for sequence_no, (lat, lng) in enumerate(polyline.decode(route)))
+        if len(coordinates) >= BATCH_SIZE:
+            Coordinate.objects.bulk_create(coordinates)
+            coordinates = []
+    Coordinate.objects.bulk_create(coordinates)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rides', '0004_ride_updated_at_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ride',
+            name='route',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.RunPython(coordinates_to_route, route_to_coordinates),
+        migrations.DeleteModel(
+            name='Coordinate',
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.1.1 on 2026-10-19 13:18
+
+from django.db import migrations, models
+
+from utils import polyline
+
+BATCH_SIZE = 1000
+
+
+def count_route_points(apps, schema_editor):
+    # routes saved before simplification keep all submitted points
+    Ride = apps.get_model('rides', 'Ride')
+    rides = []
+    for ride in Ride.objects.exclude(route='').only('ride_id', 'route').iterator(chunk_size=BATCH_SIZE):
+        ride.route_original_points = ride.route_points = sum(1 for _ in polyline.decode(ride.route))
+        rides.append(ride)
+        if len(rides) == BATCH_SIZE:
+            Ride.objects.bulk_update(rides, ['route_original_points', 'route_points'])
+            rides = []
+    Ride.objects.bulk_update(rides, ['route_original_points', 'route_points'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rides', '0005_ride_route'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ride',
+            name='route_original_points',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='ride',
+            name='route_points',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(count_route_points, migrations.RunPython.noop),
+    ]
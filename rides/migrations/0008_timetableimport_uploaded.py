@@ -0,0 +1,18 @@
+# Generated by Django 4.1.1 on 2026-10-19 13:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rides', '0007_timetableimport'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='timetableimport',
+            name='uploaded',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -2,6 +2,7 @@ from datetime import timedelta
 
 from django.contrib import admin
 from django.db import models
+from django.db.models import Q
 
 from cities.models import City
 from users.models import User
@@ -10,6 +11,16 @@ from vehicles.models import Vehicle
 from django.db.models.signals import m2m_changed
 
 
+class CurrentRideManager(models.Manager):
+    """
+    Returns only rides that were not archived yet. Archived rides wait only for the nightly purge,
+    so queries using this manager can use partial indexes limited to current rides.
+    """
+
+    def get_queryset(self):
+        return super().get_queryset().filter(was_archived=False)
+
+
 class Ride(models.Model):
     ride_id = models.AutoField(primary_key=True)
     city_from = models.ForeignKey(City, related_name='city_from', blank=False, null=True, on_delete=models.SET_NULL)
@@ -32,6 +43,23 @@ class Ride(models.Model):
                                        on_delete=models.CASCADE,
                                        blank=True, null=True, default=None)
     was_archived = models.BooleanField(null=False, default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+    version = models.PositiveIntegerField(default=0)
+    # route points as encoded polyline with 6 decimal places (see utils.polyline)
+    route = models.TextField(blank=True, default="")
+    # number of submitted route points and of points kept after simplification
+    route_original_points = models.PositiveIntegerField(default=0)
+    route_points = models.PositiveIntegerField(default=0)
+
+    objects = CurrentRideManager()
+    all_objects = models.Manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['start_date'], condition=Q(was_archived=False), name='ride_current_start_date_idx'),
+            models.Index(fields=['city_to', 'start_date'], condition=Q(was_archived=False, is_cancelled=False),
+                         name='ride_current_city_to_idx'),
+        ]
 
     @property
     def get_available_seats(self) -> int:
@@ -42,6 +70,10 @@ class Ride(models.Model):
 
         return self.seats - reserved_seats
 
+    @property
+    def route_simplification_ratio(self) -> float:
+        return self.route_points / self.route_original_points if self.route_original_points else 1.0
+
     @property
     def can_driver_edit(self):
         return not self.passengers.filter(passenger__decision__in=['accepted', 'pending']).exists()
@@ -50,6 +82,7 @@ class Ride(models.Model):
         if not self.ride_id:
             super(Ride, self).save(*args, **kwargs)
         self.available_seats = self.get_available_seats
+        self.version += 1
         super(Ride, self).save()
 
 
@@ -83,12 +116,34 @@ def participation_changed(sender, instance, action, **kwargs):
 m2m_changed.connect(participation_changed, sender=Ride.passengers.through)
 
 
-class Coordinate(models.Model):
-    coordinate_id = models.AutoField(primary_key=True)
-    ride = models.ForeignKey(Ride, related_name='coordinates', on_delete=models.CASCADE, null=True)
-    lat = models.DecimalField(null=False, max_digits=15, decimal_places=6)
-    lng = models.DecimalField(null=False, max_digits=15, decimal_places=6)
-    sequence_no = models.IntegerField(null=False)
+class TimetableImport(models.Model):
+    """
+    Import of rides from timetable file (CSV or JSONL). Rows are imported in batches, processed_rows is updated
+    in the same transaction as rides of the batch are inserted, so failed import is resumed after the last
+    imported batch. Uploaded files (uploaded=True) are deleted when the import is completed.
+    """
+
+    class Format(models.TextChoices):
+        CSV = 'csv'
+        JSONL = 'jsonl'
+
+    class Status(models.TextChoices):
+        PENDING = 'pending'
+        RUNNING = 'running'
+        FAILED = 'failed'
+        COMPLETED = 'completed'
+
+    user = models.ForeignKey(User, related_name='timetable_imports', on_delete=models.CASCADE)
+    path = models.CharField(max_length=255)
+    uploaded = models.BooleanField(default=False)
+    format = models.CharField(choices=Format.choices, max_length=5)
+    status = models.CharField(choices=Status.choices, default=Status.PENDING, max_length=9)
+    processed_rows = models.PositiveIntegerField(default=0)
+    created_rides = models.PositiveIntegerField(default=0)
+    failed_rows = models.PositiveIntegerField(default=0)
+    errors = models.JSONField(default=list, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
 
 class ParticipationInline(admin.TabularInline):
@@ -1,18 +1,26 @@
 from collections import OrderedDict
 
+from django.conf import settings
+from django.db import transaction
 from rest_framework import serializers
 
-from cities.models import City
+from cities.cache import city_cache
 from cities.serializers import CitySerializer
 from recurrent_rides.models import RecurrentRide
-from rides.models import Ride, Participation, Coordinate
+from rides.models import Ride, Participation, TimetableImport
 from users.serializers import UserSerializer
+from utils import polyline
+from utils.geometry import simplify
+from utils.fieldsets import SparseFieldsMixin
 from vehicles.serializers import VehicleSerializer
 
 
 class ParticipationListSerializer(serializers.ListSerializer):
+    required_fields = ('decision',)
+
     def to_representation(self, data):
-        data = data.filter(decision='accepted')
+        # filtered in Python, so participations prefetched with the ride are used
+        data = [participation for participation in data.all() if participation.decision == 'accepted']
         return super(ParticipationListSerializer, self).to_representation(data)
 
 
@@ -25,13 +33,33 @@ class ParticipationNestedSerializer(serializers.ModelSerializer):
         list_serializer_class = ParticipationListSerializer
 
 
-class CoordinatesNestedSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = Coordinate
-        fields = ('lat', 'lng', 'sequence_no')
+class CoordinatesNestedSerializer(serializers.Serializer):
+    lat = serializers.DecimalField(max_digits=15, decimal_places=6)
+    lng = serializers.DecimalField(max_digits=15, decimal_places=6)
+    sequence_no = serializers.IntegerField()
+
+
+class RouteField(serializers.Field):
+    """
+    Ride route stored as encoded polyline, represented as list of points with lat, lng and sequence_no.
+    Submitted points are validated into list of (lat, lng) pairs ordered by sequence_no, which is simplified
+    and encoded before saving (see route_fields). Returned points are numbered from 0 and decoded only when
+    the field is rendered.
+    """
+
+    def to_representation(self, value):
+        # decoded values have 6 decimal places, so they are formatted the same way as DecimalField does it
+        return [{'lat': f'{lat:f}', 'lng': f'{lng:f}', 'sequence_no': sequence_no}
+                for sequence_no, (lat, lng) in enumerate(polyline.decode(value))]
 
+    def to_internal_value(self, data):
+        points = CoordinatesNestedSerializer(data=data, many=True)
+        points.is_valid(raise_exception=True)
+        ordered_points = sorted(points.validated_data, key=lambda point: point['sequence_no'])
+        return [(point['lat'], point['lng']) for point in ordered_points]
 
-class RidePersonal(serializers.ModelSerializer):
+
+class RidePersonal(SparseFieldsMixin, serializers.ModelSerializer):
     city_from = CitySerializer(many=False)
     city_to = CitySerializer(many=False)
     duration = serializers.SerializerMethodField()
@@ -49,7 +77,7 @@ class RidePersonal(serializers.ModelSerializer):
         return get_duration(obj)
 
 
-class RideListSerializer(serializers.ModelSerializer):
+class RideListSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     city_from = CitySerializer(many=False)
     city_to = CitySerializer(many=False)
     driver = UserSerializer(many=False)
@@ -98,14 +126,14 @@ class RideForReviewsSerializer(serializers.ModelSerializer):
         return obj.city_to.name
 
 
-class RideSerializer(serializers.ModelSerializer):
+class RideSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     city_from = CitySerializer(many=False)
     city_to = CitySerializer(many=False)
     driver = UserSerializer(many=False, required=False)
     vehicle = VehicleSerializer(many=False, required=False)
     duration = serializers.SerializerMethodField()
     passengers = ParticipationNestedSerializer(source='participation_set', many=True, required=False)
-    coordinates = CoordinatesNestedSerializer(many=True)
+    coordinates = RouteField(source='route')
 
     class Meta:
         model = Ride
@@ -114,31 +142,15 @@ class RideSerializer(serializers.ModelSerializer):
                   'passengers', 'coordinates')
         depth = 1
 
+    @transaction.atomic
     def update(self, instance, validated_data, **kwargs):
         requested_city_from = validated_data.get('city_from', instance.city_from)
         if type(requested_city_from) is OrderedDict:
-            city_from, _ = City.objects.get_or_create(**requested_city_from)
-            instance.city_from = city_from
+            instance.city_from = city_cache.resolve(requested_city_from)
 
         requested_city_to = validated_data.get('city_to', instance.city_to)
         if type(requested_city_to) is OrderedDict:
-            city_to, _ = City.objects.get_or_create(**requested_city_to)
-            instance.city_to = city_to
-        print(f' VALIDATED DATA -> {validated_data}')
-        coordinates = validated_data.get('coordinates', instance.coordinates.all())
-        new_coordinates = []
-        for coordinate in coordinates:
-            if type(coordinate) is OrderedDict:
-                new_coordinates.append(
-                    Coordinate.objects.get_or_create(ride=instance, lat=coordinate['lat'], lng=coordinate['lng'],
-                                                     defaults={'sequence_no': coordinate['sequence_no']})[0])
-            elif type(coordinate) is Coordinate:
-                new_coordinates.append(coordinate)
-        instance.coordinates.clear()
-
-        for coordinate in new_coordinates:
-            coordinate.ride = instance
-            coordinate.save()
+            instance.city_to = city_cache.resolve(requested_city_to)
 
         update_data = {"duration": self.context.get('duration', instance.duration),
                        "vehicle": self.context.get('vehicle', instance.vehicle),
@@ -149,18 +161,14 @@ class RideSerializer(serializers.ModelSerializer):
                        "seats": validated_data.get('seats', instance.seats),
                        "automatic_confirm": validated_data.get('automatic_confirm', instance.automatic_confirm),
                        "description": validated_data.get('description', instance.description)}
+        if 'route' in validated_data:
+            update_data.update(changed_route_fields(instance, validated_data['route']))
         update_ride(instance, update_data)
         return instance
 
     def create(self, validated_data, **kwargs):
-        driver, vehicle, duration, city_from, city_to = get_ride_data(validated_data, self.context)
-        coordinates = validated_data.pop('coordinates')
-
-        ride = Ride(driver=driver, vehicle=vehicle, city_from=city_from, city_to=city_to, duration=duration,
-                    **validated_data)
+        ride = build_ride(validated_data, self.context)
         ride.save()
-        for coordinate in coordinates:
-            Coordinate.objects.create(ride=ride, **coordinate)
 
         return ride
 
@@ -168,6 +176,13 @@ class RideSerializer(serializers.ModelSerializer):
         return get_duration(obj)
 
 
+class TimetableImportSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = TimetableImport
+        fields = ('id', 'format', 'status', 'processed_rows', 'created_rides', 'failed_rows', 'errors', 'created_at',
+                  'updated_at')
+
+
 def get_duration(obj: Ride):
     total_minutes = int(obj.duration.total_seconds() // 60)
     hours = total_minutes // 60
@@ -180,14 +195,53 @@ def update_ride(ride: Ride or RecurrentRide, update_data: dict):
     ride.save()
 
 
+def route_fields(points: list) -> dict:
+    """
+    Simplifies route with ROUTE_SIMPLIFY_TOLERANCE and returns values of ride route fields: encoded route
+    and numbers of submitted and kept points.
+
+    :param points: list of (lat, lng) pairs
+    :return: dictionary with route, route_original_points and route_points
+    """
+    simplified = simplify(points, settings.ROUTE_SIMPLIFY_TOLERANCE)
+    return {'route': polyline.encode(simplified), 'route_original_points': len(points), 'route_points': len(simplified)}
+
+
+def changed_route_fields(ride: Ride, points: list) -> dict:
+    """
+    Returns route fields to update (see route_fields) or empty dictionary if submitted points are the stored route
+    (ex. coordinates returned by the API sent back unchanged) or are simplified to it, so the route is not rewritten
+    and its original number of points is kept.
+
+    :param ride: updated ride
+    :param points: list of submitted (lat, lng) pairs
+    :return: dictionary with changed route fields
+    """
+    if polyline.encode(points) == ride.route:
+        return {}
+    fields = route_fields(points)
+    return fields if fields['route'] != ride.route else {}
+
+
+def build_ride(validated_data, context) -> Ride:
+    """
+    Returns not saved ride built from validated RideSerializer data, with resolved cities and simplified route.
+    """
+    driver, vehicle, duration, city_from, city_to = get_ride_data(validated_data, context)
+    validated_data.update(route_fields(validated_data.pop('route', [])))
+
+    return Ride(driver=driver, vehicle=vehicle, city_from=city_from, city_to=city_to, duration=duration,
+                **validated_data)
+
+
 def get_ride_data(validated_data, context):
     driver = context['driver']
     vehicle = context['vehicle']
     duration = context['duration']
 
     city_from_data = validated_data.pop('city_from')
-    city_from, _ = City.objects.get_or_create(**city_from_data)
+    city_from = city_cache.resolve(city_from_data)
     city_to_data = validated_data.pop('city_to')
-    city_to, _ = City.objects.get_or_create(**city_to_data)
+    city_to = city_cache.resolve(city_to_data)
 
     return driver, vehicle, duration, city_from, city_to
@@ -1,16 +1,52 @@
+import concurrent.futures
 import datetime
+import decimal
+import gzip
+import io
 import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from unittest import mock
 
 import factory
-from django.test import TestCase
+import jwt
+import kombu
+from celery import bootsteps
+from cryptography.hazmat.primitives.asymmetric import rsa
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import QuerySet
+from django.http import JsonResponse as DjangoJsonResponse, HttpResponse, StreamingHttpResponse
+from django.test import TestCase, SimpleTestCase, RequestFactory, override_settings
+from django.utils import timezone
+from django.utils.http import http_date
+from jwt.algorithms import RSAAlgorithm
 from rest_framework import status
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import APIClient
 
+from cities.cache import city_cache
 from cities.factories import CityFactory
 from cities.models import City
 from rides.factories import RideFactory, ParticipationFactory, RideWithPassengerFactory
-from rides.models import Ride, Participation
+from rides.models import Ride, Participation, TimetableImport
+from rides.serializers import RouteField, route_fields, changed_route_fields
+from rides_microservice import tasks
+from rides_microservice.celery import MyConsumerStep, TOPOLOGY, queue_notify, queue_reviews
 from users.factories import UserFactory
+from users.models import User, IdempotentResponse, ProcessedMessage
+from utils import snapshots, polyline
+from utils.celery_utils import MessageBatch, BATCH_HANDLERS, create_user, create_vehicle, upsert_users
+from utils.compression import CompressionMiddleware, select_encoding
+from utils.geometry import simplify
+from utils.imports import read_rides, run_import, claim_import, is_resumable
+from utils.messaging import compact_rides, expand_rides
+from utils.renderers import JsonResponse, ORJSONRenderer
+from utils.validate_token import TokenCache, KeySet, resolve_user, token_cache
 from vehicles.factories import VehicleFactory
 
 AUTH_TOKEN = "Bearer eyJhbGciOiJSUzI1NiIsInR5cCIgOiAiSldUIiwia2lkIiA6ICJleUhzZzNlRkdiQzdTWjRQOEtWYXQ2aWJDLVlJWmE2dU03RnYycTdWQWhvIn0.eyJleHAiOjE2Njk3NzA0NDcsImlhdCI6MTY2OTc1MjQ0NywiYXV0aF90aW1lIjoxNjY5NzUyNDQ3LCJqdGkiOiIxY2IzNDU2Yy01Y2YwLTRmOTQtOTcxNS1hMTQ3MjhlYWRlMmMiLCJpc3MiOiJodHRwOi8vbG9jYWxob3N0Ojg0MDMvYXV0aC9yZWFsbXMvVHJhV2VsbCIsImF1ZCI6WyJzb2NpYWwtb2F1dGgiLCJyZWFjdCIsImFjY291bnQiXSwic3ViIjoiN2FkNWFkZjctOWM2ZS00YjhhLThjNWYtM2ZlOWZjMTNlY2IyIiwidHlwIjoiQmVhcmVyIiwiYXpwIjoia3Jha2VuZCIsInNlc3Npb25fc3RhdGUiOiIxYjAwNDJhZC1lMDAxLTQ3MjAtOWFhYy02MmM1MmE4NDg1OGEiLCJhY3IiOiIxIiwiYWxsb3dlZC1vcmlnaW5zIjpbImh0dHA6Ly9sb2NhbGhvc3Q6OTAwMCJdLCJyZWFsbV9hY2Nlc3MiOnsicm9sZXMiOlsib2ZmbGluZV9hY2Nlc3MiLCJ1bWFfYXV0aG9yaXphdGlvbiIsImFwcC11c2VyIiwiZGVmYXVsdC1yb2xlcy10cmF3ZWxsIl19LCJyZXNvdXJjZV9hY2Nlc3MiOnsic29jaWFsLW9hdXRoIjp7InJvbGVzIjpbInVzZXIiXX0sImtyYWtlbmQiOnsicm9sZXMiOlsidXNlciJdfSwicmVhY3QiOnsicm9sZXMiOlsidXNlciJdfSwiYWNjb3VudCI6eyJyb2xlcyI6WyJtYW5hZ2UtYWNjb3VudCIsIm1hbmFnZS1hY2NvdW50LWxpbmtzIiwidmlldy1wcm9maWxlIl19fSwic2NvcGUiOiJvcGVuaWQgcHJvZmlsZSBlbWFpbCIsInNpZCI6IjFiMDA0MmFkLWUwMDEtNDcyMC05YWFjLTYyYzUyYTg0ODU4YSIsImVtYWlsX3ZlcmlmaWVkIjp0cnVlLCJ1c2VyX3R5cGUiOiJDb21wYW55IEFjY291bnQiLCJkYXRlX29mX2JpcnRoIjoiMjAwMC0wNy0wOSIsImZhY2Vib29rIjoiIiwibmFtZSI6IkhhbGluYSBLYWN6bWFyZWsiLCJwcmVmZXJyZWRfdXNlcm5hbWUiOiJmbWFqcm94QGdtYWlsLmNvbSIsImluc3RhZ3JhbSI6IiIsImdpdmVuX25hbWUiOiJIYWxpbmEiLCJmYW1pbHlfbmFtZSI6IkthY3ptYXJlayIsImVtYWlsIjoiZm1hanJveEBnbWFpbC5jb20ifQ.LF8mzghB_oh0mlF0avL_rUKRZb1nT2pDmbhfAOTlTba3N9F1jjX_rjAL4bQ-YZlf3pw9VcD-C3GT7Mfb3HS_75CkJhkzJmJliOLQf36wOULL8j1x4iBMjcKN_Pn8Pu_u5GnEgcldeg_uuTakGN2VXgPdMuW4RkIanhqSpIQVkw8JHkNWM3q13CZ5TelTkLyHdPDaAm2xqMG-u0LFhTTUtPcep6eZ-Nk4s0YfbHyt8zW176MQmipaFV4lhzEGdWstnPqXu1oZ8X7b2v4jjoXDNeCgaYpvjOFQ-feJoGdR-jTvSWCugbSg-RDST6XL1B4vK_HMMJQAbW-C5tJHHd3omQ"
@@ -112,6 +148,45 @@ class RideViewSetTests(TestCase):
 
         self.assertEqual(results['ride_id'], ride_factory.ride_id)
 
+    def test_returns_only_requested_fields(self):
+        ride_factory = RideWithPassengerFactory(**{'participation__decision': 'accepted'})
+
+        response = self.client.get(f"/rides/{ride_factory.ride_id}/?fields=ride_id,price,city_from,passengers"
+                                   f"&expand=passengers")
+        results = json.loads(response.content)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(results), {'ride_id', 'price', 'city_from', 'passengers'})
+        self.assertEqual(results['city_from'], ride_factory.city_from.city_id)
+        self.assertEqual(len(results['passengers']), 1)
+
+    def test_collapses_relation_nested_in_expanded_list(self):
+        ride_factory = RideWithPassengerFactory(**{'participation__decision': 'accepted'})
+        participation = ride_factory.participation_set.get()
+
+        response = self.client.get(f"/rides/{ride_factory.ride_id}/?expand=passengers.decision")
+        results = json.loads(response.content)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(results['passengers'], [{'id': participation.id, 'user': participation.user_id,
+                                                  'decision': 'accepted'}])
+        self.assertEqual(results['driver'], ride_factory.driver_id)
+
+    def test_returns_not_modified_for_current_etag(self):
+        ride_factory = RideFactory()
+
+        response = self.client.get(f"/rides/{ride_factory.ride_id}/")
+        etag = response['ETag']
+        not_modified = self.client.get(f"/rides/{ride_factory.ride_id}/", HTTP_IF_NONE_MATCH=etag)
+
+        ride_factory.price += 1
+        ride_factory.save()
+        modified = self.client.get(f"/rides/{ride_factory.ride_id}/", HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(modified.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(modified['ETag'], etag)
+
     def test_get_not_existing_ride(self):
         response = self.client.get(f"/rides/1/")
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
@@ -122,6 +197,24 @@ class RideViewSetTests(TestCase):
 
         response = self.client.post(f"/rides/", data=post_data, format='json')
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(json.loads(response.content), 'Invalid token provided')
+
+    def test_returns_details_with_invalid_token(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer invalid')
+        ride_factory = RideFactory()
+
+        response = self.client.get(f"/rides/{ride_factory.ride_id}/")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_post_ride_with_invalid_token(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer invalid')
+        post_data = prepare_data_for_post()
+
+        response = self.client.post(f"/rides/", data=post_data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(json.loads(response.content), 'Token decoding failure')
 
     def test_post_ride_successful(self):
         post_data = prepare_data_for_post()
@@ -153,6 +246,83 @@ class RideViewSetTests(TestCase):
         self.assertEqual(rides_after_post, 1)
         self.assertEqual(cities_after_post, 2)
 
+    @mock.patch('utils.services.tasks.publish_fanout')
+    def test_post_ride_retry_with_idempotency_key(self, publish_fanout):
+        post_data = prepare_data_for_post()
+
+        response = self.client.post(f"/rides/", data=post_data, format='json', HTTP_IDEMPOTENCY_KEY='ride-1')
+        retry = self.client.post(f"/rides/", data=post_data, format='json', HTTP_IDEMPOTENCY_KEY='ride-1')
+        other_request = self.client.post(f"/rides/", data=dict(post_data, price=1), format='json',
+                                         HTTP_IDEMPOTENCY_KEY='ride-1')
+
+        self.assertEqual(retry.status_code, status.HTTP_200_OK)
+        self.assertEqual(retry.content, response.content)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(other_request.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(Ride.objects.count(), 1)
+        self.assertEqual(publish_fanout.call_count, 1)
+
+    @mock.patch('utils.services.tasks.publish_fanout')
+    def test_post_ride_retry_while_first_request_is_processed(self, publish_fanout):
+        post_data = prepare_data_for_post()
+        self.client.post(f"/rides/", data=post_data, format='json', HTTP_IDEMPOTENCY_KEY='ride-1')
+        IdempotentResponse.objects.update(status=0, body=b'')
+
+        retry = self.client.post(f"/rides/", data=post_data, format='json', HTTP_IDEMPOTENCY_KEY='ride-1')
+
+        self.assertEqual(retry.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(Ride.objects.count(), 1)
+
+    @mock.patch('utils.services.tasks.publish_fanout')
+    @override_settings(IDEMPOTENCY_PROCESSING_TIMEOUT=60)
+    def test_post_ride_retry_after_first_request_was_abandoned(self, publish_fanout):
+        post_data = prepare_data_for_post()
+        self.client.post(f"/rides/", data=post_data, format='json', HTTP_IDEMPOTENCY_KEY='ride-1')
+        Ride.objects.all().delete()
+        IdempotentResponse.objects.update(status=0, body=b'',
+                                          created_at=timezone.now() - datetime.timedelta(seconds=61))
+
+        retry = self.client.post(f"/rides/", data=post_data, format='json', HTTP_IDEMPOTENCY_KEY='ride-1')
+        replay = self.client.post(f"/rides/", data=post_data, format='json', HTTP_IDEMPOTENCY_KEY='ride-1')
+
+        self.assertEqual(retry.status_code, status.HTTP_200_OK)
+        self.assertEqual(Ride.objects.count(), 1)
+        self.assertEqual(replay.content, retry.content)
+        self.assertEqual(replay['Idempotent-Replayed'], 'true')
+
+    def test_post_rides_bulk_successful(self):
+        post_data = prepare_data_for_post(user_private=False)
+
+        response = self.client.post(f"/rides/bulk/", data=[post_data], format='json')
+        content = json.loads(response.content)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(content['errors'], [])
+        ride = Ride.objects.get(ride_id=content['created'][0]['ride_id'])
+        self.assertEqual(ride.driver.email, 'fmajrox@gmail.com')
+        self.assertIsNone(ride.vehicle)
+
+    def test_post_rides_bulk_reports_invalid_rides(self):
+        post_data = prepare_data_for_post(user_private=False)
+        invalid_data = dict(post_data, duration={'hours': -2, 'minutes': 0})
+
+        response = self.client.post(f"/rides/bulk/", data=[post_data, invalid_data, post_data], format='json')
+        content = json.loads(response.content)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(content['created']), 2)
+        self.assertEqual([error['index'] for error in content['errors']], [1])
+        self.assertEqual(Ride.objects.filter(available_seats=post_data['seats']).count(), 2)
+        self.assertEqual(City.objects.count(), 2)
+
+    def test_post_rides_bulk_for_private_user(self):
+        post_data = prepare_data_for_post(user_private=True)
+
+        response = self.client.post(f"/rides/bulk/", data=[post_data], format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+        self.assertFalse(Ride.objects.exists())
+
     def test_post_ride_incorrect_data(self):
         post_data = prepare_data_for_post()
         post_data['duration']['hours'] = -2
@@ -258,7 +428,7 @@ class RideViewSetTests(TestCase):
         ride_after_update = Ride.objects.get(ride_id=content['ride_id'])
         self.assertEqual(ride_after_update.city_from.name, city_from['name'])
         self.assertEqual(ride_after_update.city_to.name, city_to['name'])
-        self.assertEqual(len(ride_after_update.coordinates.all()), len(ride_data['coordinates']))
+        self.assertEqual(len(list(polyline.decode(ride_after_update.route))), len(ride_data['coordinates']))
         self.assertEqual(float(ride_after_update.price), ride_data['price'])
         self.assertEqual(ride_after_update.start_date.isoformat()[:-6] + 'Z', ride_data['start_date'])
         self.assertEqual(ride_after_update.seats, ride_data['seats'])
@@ -401,6 +571,19 @@ class RideViewSetTests(TestCase):
         self.assertEqual(status_code, status.HTTP_200_OK)
         self.assertEqual(content['count'], 5)
 
+    def test_user_rides_are_validated_by_etag_only(self):
+        user = UserFactory.create(email='fmajrox@gmail.com')
+        rides = RideFactory.create_batch(size=2, driver=user)
+
+        response = self.client.get(f'/rides/user_rides/', {'user_type': 'driver'})
+        Ride.objects.filter(ride_id=rides[0].ride_id).update(was_archived=True)
+        modified = self.client.get(f'/rides/user_rides/', {'user_type': 'driver'},
+                                   HTTP_IF_MODIFIED_SINCE=http_date(time.time()))
+
+        self.assertFalse(response.has_header('Last-Modified'))
+        self.assertEqual(modified.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(modified.content)['count'], 1)
+
     def test_check_edition_permission(self):
         user = UserFactory.create(email='fmajrox@gmail.com')
         vehicle = VehicleFactory.create(user=user)
@@ -411,3 +594,664 @@ class RideViewSetTests(TestCase):
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(json.loads(response.content), {"full_permission": False})
+
+
+class CompactEventFormatTests(SimpleTestCase):
+    def test_compact_rides_sends_shared_values_once(self):
+        rides = [{'ride_id': ride_id, 'start_date': f'2022-12-2{ride_id}T20:00:00Z', 'price': '20.50',
+                  'available_seats': 3 if ride_id else 1} for ride_id in range(3)]
+
+        message = compact_rides(rides)
+
+        self.assertEqual(message['template'], {'price': '20.50'})
+        self.assertEqual(message['fields'], ['ride_id', 'start_date', 'available_seats'])
+        self.assertEqual(expand_rides(message), rides)
+
+
+def user_message_body(user_id: int, **changes) -> dict:
+    message = {'user_id': user_id, 'first_name': 'Anna', 'last_name': 'Sowa', 'email': f'user{user_id}@sowa.com',
+               'avatar': '', 'user_type': 'private', 'avg_rate': '4.50'}
+    message.update(changes)
+    return {'title': 'users', 'message': message}
+
+
+def consumed_message(message_id: str or None = None, redelivered: bool = False):
+    return mock.Mock(properties={'message_id': message_id} if message_id else {},
+                     delivery_info={'redelivered': redelivered})
+
+
+class MessageBatchTests(TestCase):
+    def test_batch_is_acknowledged_with_single_ack(self):
+        batch = MessageBatch(size=3)
+        messages = [consumed_message(f'id-{user_id}') for user_id in range(1, 4)]
+
+        for user_id, message in enumerate(messages, start=1):
+            batch.add(user_message_body(user_id), message)
+
+        self.assertEqual(User.objects.count(), 3)
+        messages[0].ack.assert_not_called()
+        messages[1].ack.assert_not_called()
+        messages[2].ack.assert_called_once_with(multiple=True)
+
+    def test_failed_batch_is_processed_one_by_one(self):
+        batch = MessageBatch(size=10)
+        broken_body = user_message_body(2)
+        del broken_body['message']['email']
+        valid, broken = consumed_message('id-1'), consumed_message('id-2')
+        redelivered, duplicate = consumed_message('id-3', redelivered=True), consumed_message('id-1')
+
+        for body, message in [(user_message_body(1), valid), (broken_body, broken), (broken_body, redelivered),
+                              (user_message_body(1), duplicate)]:
+            batch.add(body, message)
+        with self.assertLogs('utils.celery_utils', level='ERROR'):
+            batch.flush()
+
+        self.assertEqual(list(User.objects.values_list('user_id', flat=True)), [1])
+        valid.ack.assert_called_once_with()
+        broken.requeue.assert_called_once_with()
+        broken.ack.assert_not_called()
+        redelivered.reject.assert_called_once_with(requeue=False)
+        redelivered.requeue.assert_not_called()
+        duplicate.ack.assert_called_once_with()
+
+    @mock.patch.object(bootsteps.ConsumerStep, 'shutdown')
+    @mock.patch.object(bootsteps.ConsumerStep, 'start')
+    def test_consumer_flushes_batch_on_timer_and_shutdown(self, start, shutdown):
+        consumer = mock.Mock(connection=mock.Mock(connection_errors=(), channel_errors=()))
+        with self.settings(RIDES_CONSUMER_BATCH_SIZE=10, RIDES_CONSUMER_FLUSH_INTERVAL=2):
+            step = MyConsumerStep(mock.Mock())
+            step.start(consumer)
+        interval, flush = consumer.timer.call_repeatedly.call_args.args
+        first, second = consumed_message('id-1'), consumed_message('id-2')
+
+        step.handle_message(user_message_body(1), first)
+        first.ack.assert_not_called()
+        flush()
+        first.ack.assert_called_once_with(multiple=True)
+
+        step.handle_message(user_message_body(2), second)
+        step.shutdown(consumer)
+        second.ack.assert_called_once_with(multiple=True)
+        consumer.timer.call_repeatedly.return_value.cancel.assert_called_once_with()
+        self.assertEqual(interval, 2)
+        self.assertEqual(User.objects.count(), 2)
+
+
+class MessageDeduplicationTests(TestCase):
+    def test_redelivered_message_is_skipped(self):
+        batch = MessageBatch(size=1)
+        redelivered = consumed_message('id-1', redelivered=True)
+
+        batch.add(user_message_body(1), consumed_message('id-1'))
+        batch.add(user_message_body(1, first_name='Changed'), redelivered)
+
+        self.assertEqual(User.objects.get(user_id=1).first_name, 'Anna')
+        redelivered.ack.assert_called_once_with(multiple=True)
+
+    def test_repeated_state_is_skipped_and_change_back_is_applied(self):
+        handler = mock.Mock(wraps=upsert_users)
+        batch = MessageBatch(size=1)
+
+        with mock.patch.dict(BATCH_HANDLERS, {'users': handler}):
+            for first_name in ['Anna', 'Anna', 'Changed', 'Anna']:
+                batch.add(user_message_body(1, first_name=first_name), consumed_message())
+
+        self.assertEqual(handler.call_count, 3)
+        self.assertEqual(User.objects.get(user_id=1).first_name, 'Anna')
+
+    @override_settings(RIDES_DEDUP_WINDOW=60)
+    def test_processed_keys_survive_restart_within_window(self):
+        MessageBatch(size=1).add(user_message_body(1), consumed_message('id-1'))
+
+        MessageBatch(size=1).add(user_message_body(1, first_name='Changed'), consumed_message('id-1'))
+        self.assertEqual(User.objects.get(user_id=1).first_name, 'Anna')
+
+        ProcessedMessage.objects.update(processed_at=timezone.now() - datetime.timedelta(seconds=61))
+        MessageBatch(size=1).add(user_message_body(1, first_name='Changed'), consumed_message('id-1'))
+        self.assertEqual(User.objects.get(user_id=1).first_name, 'Changed')
+
+    def test_unchanged_user_and_vehicle_are_not_written(self):
+        user_message = user_message_body(1)['message']
+        vehicle_message = {'vehicle_id': 1, 'make': 'Skoda', 'model': 'Fabia', 'color': 'red', 'user': user_message}
+        create_vehicle(vehicle_message)
+
+        with self.assertNumQueries(1):
+            create_user(user_message)
+        with self.assertNumQueries(1):
+            upsert_users([user_message])
+        with self.assertNumQueries(2):
+            create_vehicle(vehicle_message)
+
+        create_user(dict(user_message, first_name='Changed'))
+        self.assertEqual(User.objects.get(user_id=1).first_name, 'Changed')
+
+
+IMPORT_WITHOUT_NETWORK_SCRIPT = '''
+import socket
+
+import kombu
+
+
+def refuse(*args, **kwargs):
+    raise ConnectionRefusedError('connection opened during import')
+
+
+socket.socket.connect = socket.socket.connect_ex = kombu.Connection._establish_connection = refuse
+
+import django
+
+django.setup()
+import rides_microservice.urls
+import rides_microservice.tasks
+'''
+
+
+class PublishingTests(SimpleTestCase):
+    def _publish(self, publish):
+        """
+        Runs publish with producer of in-memory broker and returns decoded messages and payloads received
+        by notifications and reviews queues.
+        """
+        received = {}
+        with kombu.Connection('memory://') as connection, \
+                mock.patch('celery.app.base.Celery.producer_pool', new_callable=mock.PropertyMock) as producer_pool:
+            producer_pool.return_value.acquire.return_value.__enter__.return_value = connection.Producer()
+            # in-memory broker state is shared by all connections of the process
+            for queue in [queue_notify, queue_reviews]:
+                connection.default_channel.queue_purge(queue.name)
+            publish()
+            for queue in [queue_notify, queue_reviews]:
+                received[queue.name] = []
+                while (message := queue(connection).get(no_ack=True)) is not None:
+                    received[queue.name].append((message.decode(), message.body))
+        return received
+
+    def test_fanout_delivers_one_payload_to_every_routing_key(self):
+        received = self._publish(lambda: tasks.publish_fanout({'ride_id': 1}, 'rides.create', ['notify', 'review']))
+
+        self.assertEqual(received['notifications'], received['reviews'])
+        self.assertEqual([body for body, _ in received['notifications']],
+                         [{'title': 'rides.create', 'message': {'ride_id': 1}}])
+
+    def test_importing_application_opens_no_connection(self):
+        result = subprocess.run([sys.executable, '-c', IMPORT_WITHOUT_NETWORK_SCRIPT], capture_output=True, text=True,
+                                cwd=settings.BASE_DIR)
+
+        self.assertEqual(result.returncode, 0, result.stderr)
+
+    def test_topology_is_declared_on_first_publish(self):
+        declared = []
+
+        def recorded(entity_class):
+            declare = entity_class.declare
+
+            def record(entity, *args, **kwargs):
+                declared.append(entity.name)
+                return declare(entity, *args, **kwargs)
+
+            return mock.patch.object(entity_class, 'declare', autospec=True, side_effect=record)
+
+        with recorded(kombu.Exchange), recorded(kombu.Queue):
+            received = self._publish(lambda: tasks.publish_fanout({'ride_id': 1}, 'rides.create', ['notify']))
+
+        self.assertEqual(set(declared), {entity.name for entity in TOPOLOGY})
+        self.assertEqual(len(received['notifications']), 1)
+
+    @override_settings(EVENTS_COMPACT_BULK=False)
+    def test_chunks_are_delivered_to_every_routing_key(self):
+        chunks = [[{'ride_id': 1}, {'ride_id': 2}], [{'ride_id': 3}]]
+
+        received = self._publish(lambda: tasks.publish_chunks(iter(chunks), 'rides.create.many', ['notify', 'review']))
+
+        self.assertEqual(received['notifications'], received['reviews'])
+        bodies = [body for body, _ in received['notifications']]
+        self.assertEqual([body['message'] for body in bodies], chunks)
+        self.assertEqual([(body['chunk']['seq'], body['chunk']['last']) for body in bodies], [(0, False), (1, True)])
+
+
+class ArchiveTaskTests(TestCase):
+    @mock.patch('rides_microservice.tasks._publish_chunk', side_effect=lambda *args, last, **kwargs: args[5] + 1)
+    @mock.patch('celery.app.base.Celery.producer_pool', new_callable=mock.PropertyMock)
+    @mock.patch.object(tasks.archive_selected, 'apply_async')
+    def test_archive_publishes_chunks_and_marks_rides(self, apply_async, producer_pool, publish_chunk):
+        past_date = datetime.datetime.now(tz=datetime.timezone.utc) - datetime.timedelta(days=1)
+        past_rides = RideFactory.create_batch(3, start_date=past_date)
+        cancelled_ride = RideFactory.create(is_cancelled=True)
+        future_ride = RideFactory.create()
+
+        with self.settings(EVENTS_CHUNK_SIZE=2):
+            tasks.archive()
+
+        archived = [ride.ride_id for ride in past_rides] + [cancelled_ride.ride_id]
+        self.assertCountEqual(Ride.all_objects.filter(was_archived=True).values_list('ride_id', flat=True), archived)
+        self.assertFalse(Ride.all_objects.get(ride_id=future_ride.ride_id).was_archived)
+        self.assertEqual(publish_chunk.call_count, 4)
+        self.assertEqual([call.kwargs['last'] for call in publish_chunk.call_args_list], [False, False, True, True])
+
+    @mock.patch('celery.app.base.Celery.producer_pool', new_callable=mock.PropertyMock)
+    def test_archive_publishes_only_marked_rides(self, producer_pool):
+        past_date = datetime.datetime.now(tz=datetime.timezone.utc) - datetime.timedelta(days=1)
+        ride = RideFactory.create(start_date=past_date)
+        published = []
+
+        def publish_chunk(*args, last, **kwargs):
+            published.append(Ride.all_objects.get(ride_id=ride.ride_id).was_archived)
+            return args[5] + 1
+
+        with mock.patch('rides_microservice.tasks._publish_chunk', side_effect=publish_chunk), \
+                mock.patch.object(QuerySet, 'update', side_effect=RuntimeError):
+            self.assertRaises(RuntimeError, tasks.archive_rides, tasks.archive_candidates())
+        self.assertEqual(published, [])
+
+        with mock.patch('rides_microservice.tasks._publish_chunk', side_effect=publish_chunk):
+            tasks.archive_rides(tasks.archive_candidates())
+        self.assertEqual(published, [True, True])
+
+    @mock.patch('rides_microservice.tasks._publish_chunk', side_effect=lambda *args, last, **kwargs: args[5] + 1)
+    @mock.patch('celery.app.base.Celery.producer_pool', new_callable=mock.PropertyMock)
+    def test_archive_writes_snapshot_after_commit(self, producer_pool, publish_chunk):
+        past_date = datetime.datetime.now(tz=datetime.timezone.utc) - datetime.timedelta(days=1)
+        ride = RideFactory.create(start_date=past_date)
+
+        with tempfile.TemporaryDirectory() as directory, self.settings(RIDES_SNAPSHOT_DIR=directory):
+            with mock.patch.object(QuerySet, 'update', side_effect=RuntimeError):
+                self.assertRaises(RuntimeError, tasks.archive_rides, tasks.archive_candidates())
+            self.assertEqual(list(snapshots.read_rides('rides.archive', 'history')), [])
+
+            tasks.archive_rides(tasks.archive_candidates())
+            self.assertEqual([data['ride_id'] for data in snapshots.read_rides('rides.archive', 'history')],
+                             [ride.ride_id])
+
+    @mock.patch('rides_microservice.tasks.archive_rides')
+    @mock.patch.object(tasks.archive_selected, 'apply_async')
+    def test_archive_does_not_schedule_rides_scheduled_before(self, apply_async, archive_rides):
+        now = datetime.datetime.now(tz=datetime.timezone.utc)
+        RideFactory.create(start_date=now + datetime.timedelta(minutes=5))
+        later = RideFactory.create(start_date=now + datetime.timedelta(minutes=15))
+
+        with self.settings(RIDES_ARCHIVE_SWEEP_INTERVAL=600):
+            tasks.archive()
+
+        self.assertEqual([call.args[0][0] for call in apply_async.call_args_list], [[later.ride_id]])
+
+    @mock.patch('rides_microservice.tasks._publish_chunk')
+    @mock.patch.object(tasks.archive_selected, 'apply_async')
+    def test_archive_without_rides_publishes_nothing(self, apply_async, publish_chunk):
+        RideFactory.create()
+
+        tasks.archive()
+
+        publish_chunk.assert_not_called()
+
+    @mock.patch.object(tasks.archive_selected, 'apply_async')
+    def test_schedule_archive_at_ride_start(self, apply_async):
+        now = datetime.datetime.now(tz=datetime.timezone.utc)
+        soon = now + datetime.timedelta(minutes=5)
+        starting_soon = RideFactory.create(start_date=soon)
+        cancelled = RideFactory.create(is_cancelled=True)
+        RideFactory.create(start_date=now + datetime.timedelta(days=10))
+
+        with self.settings(RIDES_ARCHIVE_SWEEP_INTERVAL=600):
+            tasks.schedule_archive(Ride.objects.all())
+
+        scheduled = {call.kwargs['eta']: call.args[0][0] for call in apply_async.call_args_list}
+        self.assertEqual(scheduled[soon], [starting_soon.ride_id])
+        self.assertIn([cancelled.ride_id], scheduled.values())
+        self.assertEqual(len(scheduled), 2)
+
+    @mock.patch('rides_microservice.tasks._publish_chunk', side_effect=lambda *args, last, **kwargs: args[5] + 1)
+    @mock.patch('celery.app.base.Celery.producer_pool', new_callable=mock.PropertyMock)
+    def test_clear_from_archived_deletes_rides_in_chunks(self, producer_pool, publish_chunk):
+        RideWithPassengerFactory.create_batch(3, was_archived=True)
+        ride = RideFactory.create()
+
+        with self.settings(EVENTS_CHUNK_SIZE=2):
+            tasks.clear_from_archived()
+
+        self.assertEqual(list(Ride.objects.values_list('ride_id', flat=True)), [ride.ride_id])
+        self.assertEqual(Participation.objects.filter(ride__isnull=True).count(), 3)
+        self.assertEqual(publish_chunk.call_count, 2)
+
+
+class SnapshotTests(SimpleTestCase):
+    def test_reads_range_of_rides_from_rotated_segments(self):
+        with tempfile.TemporaryDirectory() as directory, \
+                self.settings(RIDES_SNAPSHOT_DIR=directory, RIDES_SNAPSHOT_SEGMENT_BYTES=100):
+            for first_id in range(0, 30, 10):
+                snapshots.write_chunk('rides.sync', 'history', [{'ride_id': ride_id, 'price': '20.50'}
+                                                                for ride_id in range(first_id, first_id + 10)])
+
+            rides = list(snapshots.read_rides('rides.sync', 'history', 8, 21))
+
+        self.assertEqual([ride['ride_id'] for ride in rides], list(range(8, 22)))
+        self.assertEqual(rides[0], {'ride_id': 8, 'price': '20.50'})
+
+
+class TokenCacheTests(SimpleTestCase):
+    def test_token_is_not_cached_after_expiration(self):
+        cache = TokenCache()
+        now = datetime.datetime.now().timestamp()
+
+        cache.set('valid', {'exp': now + 60}, 1)
+        cache.set('expired', {'exp': now - 1}, 1)
+
+        self.assertEqual(cache.get('valid'), 1)
+        self.assertIsNone(cache.get('expired'))
+
+
+class ResolveUserTests(TestCase):
+    def tearDown(self) -> None:
+        token_cache.clear()
+
+    @mock.patch('utils.validate_token.decode_token')
+    def test_cached_token_returns_current_user(self, decode_token):
+        user = UserFactory.create(private=True)
+        decode_token.return_value = {'email': user.email}
+
+        self.assertEqual(resolve_user('token'), user)
+        User.objects.filter(pk=user.pk).update(private=False)
+
+        self.assertFalse(resolve_user('token').private)
+        self.assertEqual(decode_token.call_count, 1)
+
+
+class KeySetTests(SimpleTestCase):
+    def _jwk(self, key, kid):
+        jwk = json.loads(RSAAlgorithm.to_jwk(key.public_key()))
+        jwk.update({'kid': kid, 'use': 'sig'})
+        return jwk
+
+    def test_selects_key_by_kid_and_rejects_unknown_kid(self):
+        keys = [rsa.generate_private_key(public_exponent=65537, key_size=2048) for _ in range(2)]
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as jwks_file:
+            json.dump({'keys': [self._jwk(key, f'key-{number}') for number, key in enumerate(keys)]}, jwks_file)
+            jwks_file.flush()
+            key_set = KeySet(jwks_file.name)
+
+            with mock.patch.object(key_set, 'refresh') as refresh:
+                self.assertEqual(key_set.get('key-1').public_numbers(), keys[1].public_key().public_numbers())
+                with self.assertRaises(jwt.exceptions.DecodeError):
+                    key_set.get('key-2')
+
+        refresh.assert_called_once()
+
+    def test_concurrent_requests_wait_for_first_load(self):
+        key_set = KeySet('jwks.json')
+        key = object()
+
+        def fetch():
+            time.sleep(0.1)
+            return {'key-1': key}
+
+        with mock.patch.object(key_set, 'fetch', side_effect=fetch) as fetch_keys:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+                results = list(executor.map(lambda _: key_set.get('key-1'), range(4)))
+
+        self.assertEqual(results, [key] * 4)
+        fetch_keys.assert_called_once()
+
+    def test_failed_first_load_is_retried_by_next_request(self):
+        key_set = KeySet('jwks.json')
+        key = object()
+
+        with mock.patch.object(key_set, 'fetch', side_effect=[OSError, {'key-1': key}]):
+            with self.assertRaises(jwt.exceptions.DecodeError):
+                key_set.get('key-1')
+            self.assertIs(key_set.get('key-1'), key)
+
+
+class RendererTests(SimpleTestCase):
+    data = {'price': decimal.Decimal('20.50'), 'duration': datetime.timedelta(hours=1, minutes=30),
+            'start_date': datetime.datetime(2022, 12, 20, 20, 0, 0, 123456, tzinfo=datetime.timezone.utc),
+            'rides': [{'city': 'Kraków', 'date': datetime.date(2022, 12, 20)}]}
+
+    def test_json_response_output_matches_django(self):
+        self.assertEqual(json.loads(JsonResponse(self.data).content), json.loads(DjangoJsonResponse(self.data).content))
+
+    def test_renderer_output_matches_drf(self):
+        self.assertEqual(json.loads(ORJSONRenderer().render(self.data)), json.loads(JSONRenderer().render(self.data)))
+
+
+@override_settings(RESPONSE_COMPRESSION_ENCODINGS=['gzip'], RESPONSE_COMPRESSION_MIN_BYTES=100)
+class CompressionMiddlewareTests(SimpleTestCase):
+    body = json.dumps([{'ride_id': ride_id, 'city_from': 'Kraków', 'city_to': 'Wrocław'} for ride_id in range(50)])
+
+    def _process(self, response, accept_encoding='gzip'):
+        request = RequestFactory().get('/rides/', HTTP_ACCEPT_ENCODING=accept_encoding)
+        return CompressionMiddleware(lambda request: response)(request)
+
+    def test_selects_encoding_by_quality_and_preference(self):
+        self.assertEqual(select_encoding('gzip, br', ['zstd', 'br', 'gzip']), 'br')
+        self.assertEqual(select_encoding('gzip, br;q=0.5', ['zstd', 'br', 'gzip']), 'gzip')
+        self.assertEqual(select_encoding('*', ['zstd', 'gzip']), 'zstd')
+        self.assertIsNone(select_encoding('gzip;q=0, identity', ['gzip']))
+
+    def test_compresses_large_response(self):
+        response = self._process(HttpResponse(self.body, headers={'ETag': '"abc"'}))
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['ETag'], 'W/"abc"')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(gzip.decompress(response.content).decode(), self.body)
+
+    def test_does_not_compress_small_or_not_accepted_response(self):
+        small = self._process(HttpResponse('"Ride successfully deleted."'))
+        not_accepted = self._process(HttpResponse(self.body), accept_encoding='identity')
+
+        self.assertFalse(small.has_header('Content-Encoding'))
+        self.assertFalse(not_accepted.has_header('Content-Encoding'))
+        self.assertEqual(not_accepted.content.decode(), self.body)
+
+    def test_compresses_streaming_response(self):
+        response = self._process(StreamingHttpResponse(line + '\n' for line in self.body.split(',')))
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)).decode(),
+                         '\n'.join(self.body.split(',')) + '\n')
+
+
+class RouteFieldTests(SimpleTestCase):
+    coordinates = [{'lat': '50.064652', 'lng': '19.944979', 'sequence_no': 1},
+                   {'lat': '50.061947', 'lng': '19.936856', 'sequence_no': 0},
+                   {'lat': '-33.868820', 'lng': '151.209296', 'sequence_no': 2}]
+
+    def test_polyline_round_trip(self):
+        points = [(decimal.Decimal(point['lat']), decimal.Decimal(point['lng'])) for point in self.coordinates]
+
+        self.assertEqual(list(polyline.decode(polyline.encode(points))), points)
+
+    def test_returns_points_ordered_by_sequence_no(self):
+        field = RouteField()
+        points = field.to_internal_value(self.coordinates)
+
+        self.assertEqual(field.to_representation(polyline.encode(points)),
+                         sorted(self.coordinates, key=lambda point: point['sequence_no']))
+        self.assertEqual(field.to_representation(''), [])
+
+    def test_simplification_keeps_route_within_tolerance(self):
+        # dense trace along a straight street with a single 100 m detour
+        points = [(decimal.Decimal('50.000000') + decimal.Decimal(i) / 100000, decimal.Decimal('19.900000'))
+                  for i in range(200)]
+        points[100] = (points[100][0], decimal.Decimal('19.901400'))
+
+        with self.settings(ROUTE_SIMPLIFY_TOLERANCE=10):
+            fields = route_fields(points)
+        simplified = list(polyline.decode(fields['route']))
+
+        self.assertEqual(simplified, [points[0], points[99], points[100], points[101], points[-1]])
+        self.assertEqual((fields['route_original_points'], fields['route_points']), (200, 5))
+        self.assertEqual(simplify(points, 0), points)
+
+    def test_unchanged_route_is_not_rewritten(self):
+        points = RouteField().to_internal_value(self.coordinates)
+        ride = Ride(**route_fields(points))
+        changed_points = points[:2]
+
+        self.assertEqual(changed_route_fields(ride, points), {})
+        self.assertEqual(changed_route_fields(ride, changed_points), route_fields(changed_points))
+
+
+class CityCacheTests(TestCase):
+    def setUp(self) -> None:
+        city_cache.clear()
+
+    def tearDown(self) -> None:
+        city_cache.clear()
+
+    def _city(self, **kwargs) -> City:
+        city = CityFactory.create(**kwargs)
+        city.refresh_from_db()
+        return city
+
+    @staticmethod
+    def _key(city: City) -> tuple:
+        return city.name, city.county, city.state
+
+    def _cache(self, city: City) -> None:
+        with self.captureOnCommitCallbacks(execute=True):
+            city_cache.find(*self._key(city))
+
+    def test_resolves_cached_city_within_tolerance(self):
+        city = self._city()
+        city_data = {'name': city.name, 'county': city.county, 'state': city.state,
+                     'lat': city.lat + decimal.Decimal('0.001'), 'lng': city.lng}
+        self._cache(city)
+
+        with self.settings(CITY_COORDINATES_TOLERANCE=0.01), self.assertNumQueries(0):
+            cities = [city_cache.resolve(city_data) for _ in range(3)]
+
+        self.assertEqual(cities, [city] * 3)
+
+    def test_creates_city_outside_tolerance(self):
+        city = self._city()
+        city_data = {'name': city.name, 'county': city.county, 'state': city.state, 'lat': city.lat + 1,
+                     'lng': city.lng}
+        self._cache(city)
+
+        with self.settings(CITY_COORDINATES_TOLERANCE=0.01):
+            created = city_cache.resolve(city_data)
+
+        self.assertNotEqual(created, city)
+        self.assertEqual(City.objects.filter(name=city.name).count(), 2)
+
+    def test_does_not_cache_city_of_rolled_back_transaction(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                city = self._city()
+                self.assertEqual(city_cache.find(*self._key(city)), city)
+                raise RuntimeError()
+
+        self.assertEqual(city_cache.cities, {})
+        self.assertIsNone(city_cache.find(*self._key(city)))
+
+    def test_signals_invalidate_cached_cities(self):
+        city = self._city()
+        self._cache(city)
+        with self.captureOnCommitCallbacks(execute=True):
+            self._city(name=city.name, county=city.county, state=city.state, lat=city.lat + 1)
+        self.assertNotIn(self._key(city), city_cache.cities)
+
+        self._cache(city)
+        with self.captureOnCommitCallbacks(execute=True):
+            city.name += ' Górny'
+            city.save()
+        self.assertEqual(city_cache.cities, {})
+
+        self._cache(city)
+        with self.captureOnCommitCallbacks(execute=True):
+            city.delete()
+        self.assertEqual(city_cache.cities, {})
+
+    def test_concurrently_created_city_is_returned(self):
+        city = self._city()
+        city_data = {'name': city.name, 'county': city.county, 'state': city.state, 'lat': city.lat, 'lng': city.lng}
+        get = QuerySet.get
+        lookups = []
+
+        def concurrent_get(queryset, *args, **kwargs):
+            lookups.append(kwargs)
+            if len(lookups) == 1:
+                # the city is created by another request after this lookup
+                raise City.DoesNotExist()
+            return get(queryset, *args, **kwargs)
+
+        with mock.patch.object(city_cache, 'find', return_value=None), \
+                mock.patch.object(QuerySet, 'get', autospec=True, side_effect=concurrent_get):
+            resolved = city_cache.resolve(city_data)
+
+        self.assertEqual(resolved, city)
+        self.assertEqual(len(lookups), 2)
+        self.assertEqual(City.objects.count(), 1)
+
+
+class TimetableFileTests(SimpleTestCase):
+    def test_reads_csv_rows_as_ride_data(self):
+        file = io.StringIO('city_from_name,city_from_county,city_from_state,city_from_lat,city_from_lng,'
+                           'city_to_name,city_to_county,city_to_state,city_to_lat,city_to_lng,start_date,price,seats,'
+                           'duration_hours,duration_minutes,coordinates,description\n'
+                           'Kraków,Kraków,Małopolskie,50.06,19.93,Tarnów,Tarnów,Małopolskie,50.01,20.98,'
+                           '2035-12-01T04:00:00Z,20.50,3,1,15,"[{""lat"": 50.06, ""lng"": 19.93, ""sequence_no"": 0}]",\n'
+                           'Kraków,Kraków,Małopolskie,50.06,19.93,Tarnów,Tarnów,Małopolskie,50.01,20.98,'
+                           '2035-12-01T04:00:00Z,20.50,3,one,15,,\n')
+
+        rides = list(read_rides(file, 'csv'))
+
+        self.assertEqual(rides[0]['city_to'], {'name': 'Tarnów', 'county': 'Tarnów', 'state': 'Małopolskie',
+                                               'lat': '50.01', 'lng': '20.98'})
+        self.assertEqual(rides[0]['duration'], {'hours': 1, 'minutes': 15})
+        self.assertEqual(rides[0]['coordinates'], [{'lat': 50.06, 'lng': 19.93, 'sequence_no': 0}])
+        self.assertNotIn('description', rides[0])
+        self.assertIsNone(rides[1])
+
+    def test_reads_jsonl_lines_lazily(self):
+        lines = iter(['{"price": 10}\n', '\n', 'invalid\n', '{"price": 30}\n'])
+
+        rides = read_rides(lines, 'jsonl')
+
+        self.assertEqual(next(rides), {'price': 10})
+        self.assertEqual(list(rides), [None, {'price': 30}])
+
+
+@mock.patch('utils.imports.publish_created_rides')
+class TimetableImportTests(TestCase):
+    def _import(self, directory: str, uploaded: bool) -> TimetableImport:
+        ride_data = prepare_data_for_post(user_private=False)
+        path = os.path.join(directory, 'rides.jsonl')
+        with open(path, 'w') as file:
+            file.write(json.dumps(ride_data, cls=DjangoJSONEncoder) + '\n')
+        user = User.objects.get(email='fmajrox@gmail.com')
+        return TimetableImport.objects.create(user=user, path=path, format='jsonl', uploaded=uploaded)
+
+    def test_imports_rides_with_vehicle_and_deletes_uploaded_file(self, publish_created_rides):
+        with tempfile.TemporaryDirectory() as directory:
+            timetable_import = self._import(directory, uploaded=True)
+
+            run_import(claim_import(timetable_import.pk))
+
+            self.assertFalse(os.path.exists(timetable_import.path))
+        timetable_import.refresh_from_db()
+        self.assertEqual(timetable_import.status, TimetableImport.Status.COMPLETED)
+        self.assertEqual((timetable_import.created_rides, timetable_import.failed_rows), (1, 0))
+
+    def test_keeps_file_imported_with_command(self, publish_created_rides):
+        with tempfile.TemporaryDirectory() as directory:
+            timetable_import = self._import(directory, uploaded=False)
+
+            run_import(claim_import(timetable_import.pk))
+
+            self.assertTrue(os.path.exists(timetable_import.path))
+
+    def test_claims_stale_running_import(self, publish_created_rides):
+        with tempfile.TemporaryDirectory() as directory:
+            timetable_import = self._import(directory, uploaded=True)
+        TimetableImport.objects.filter(pk=timetable_import.pk).update(status=TimetableImport.Status.RUNNING)
+
+        with self.settings(RIDES_IMPORT_STALE_TIMEOUT=600):
+            running = claim_import(timetable_import.pk)
+            TimetableImport.objects.filter(pk=timetable_import.pk).update(
+                updated_at=timezone.now() - datetime.timedelta(seconds=601))
+            stale = claim_import(timetable_import.pk)
+
+        self.assertIsNone(running)
+        self.assertEqual(stale.status, TimetableImport.Status.RUNNING)
+        self.assertFalse(is_resumable(stale))
@@ -1,25 +1,31 @@
 import datetime
 
 from django.db.models import QuerySet
-from django.http import JsonResponse
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 
 from rides.filters import RideFilter
-from rides.models import Ride, Participation
-from rides.serializers import RideSerializer, RideListSerializer, RidePersonal
+from rides.models import Ride, Participation, TimetableImport
+from rides.serializers import RideSerializer, RideListSerializer, RidePersonal, TimetableImportSerializer
+from rides_microservice import tasks
 from django_filters import rest_framework as filters
 from rest_framework.filters import OrderingFilter
 
+from utils.authentication import TokenAuthenticatedMixin
+from utils.conditional import conditional_get
+from utils.fieldsets import SparseFieldsViewMixin
 from utils.generic_endpoints import get_paginated_queryset
+from utils.idempotency import idempotent
+from utils.imports import file_format, save_upload, is_resumable
+from utils.renderers import JsonResponse
 from utils.selectors import city_object, rides_with_cities_nearby
-from utils.services import create_or_update_ride, update_partial_ride, update_whole_ride, cancel_ride
+from utils.services import create_or_update_ride, update_partial_ride, update_whole_ride, cancel_ride, \
+    create_rides_bulk, RIDE_KEYS
 from utils.utils import get_city_info, filter_rides_by_cities, is_user_a_driver
 from utils.CustomPagination import CustomPagination
-from utils.validate_token import validate_token
 
 
-class RideViewSet(viewsets.ModelViewSet):
+class RideViewSet(TokenAuthenticatedMixin, SparseFieldsViewMixin, viewsets.ModelViewSet):
     """
     API View Set that allows Rides to be viewed, created, updated or deleted.
     This View Set automatically provides list and detail actions.
@@ -35,7 +41,9 @@ class RideViewSet(viewsets.ModelViewSet):
     filter_backends = [filters.DjangoFilterBackend, OrderingFilter]
     filterset_class = RideFilter
     pagination_class = CustomPagination
+    public_actions = ('list', 'retrieve', 'get_filtered')
     ordering_fields = ['price', 'start_date', 'duration', 'available_seats']
+    expected_keys = RIDE_KEYS
 
     def get_serializer_class(self):
         return self.serializer_classes.get(self.action) or RideSerializer
@@ -82,23 +90,98 @@ class RideViewSet(viewsets.ModelViewSet):
 
         return get_paginated_queryset(self, filtered_queryset)
 
+    def retrieve(self, request, *args, **kwargs):
+        """
+        Endpoint for getting ride details. Returns 304 when the client has the current version of the ride.
+        """
+        lookup = {self.lookup_field: kwargs[self.lookup_url_kwarg or self.lookup_field]}
+        return conditional_get(request, self.get_queryset().filter(**lookup),
+                               lambda: super(RideViewSet, self).retrieve(request, *args, **kwargs),
+                               last_modified=True)
+
     def _create_new_ride(self, request, user):
         data = request.data
-        expected_keys = ['city_from', 'city_to', 'area_from', 'area_to', 'start_date', 'price', 'seats', 'vehicle',
-                         'duration', 'description', 'coordinates', 'automatic_confirm']
 
-        status_code, message = create_or_update_ride(data=data, keys=expected_keys, user=user,
+        status_code, message = create_or_update_ride(data=data, keys=self.expected_keys, user=user,
                                                      serializer=self.get_serializer_class())
 
         return JsonResponse(status=status_code, data=message, safe=False)
 
-    @validate_token
+    @idempotent
     def create(self, request, *args, **kwargs):
-        user = kwargs['user']
+        user = request.user
 
         response = self._create_new_ride(request=request, user=user)
         return response
 
+    @action(detail=False, methods=['post'])
+    @idempotent
+    def bulk(self, request, *args, **kwargs):
+        """
+        Endpoint for creating many rides at once, available for company users. Accepts list of rides in the same
+        format as create. Valid rides are created even if some of them are invalid.
+        :return: created rides and list of errors with indexes of invalid rides
+        """
+        user = request.user
+        if user.private:
+            return JsonResponse(status=status.HTTP_405_METHOD_NOT_ALLOWED,
+                                data="Only company users can create rides in bulk", safe=False)
+
+        status_code, message = create_rides_bulk(items=request.data, keys=self.expected_keys, user=user)
+        return JsonResponse(status=status_code, data=message, safe=False)
+
+    def _resume_import(self, import_id, user) -> JsonResponse:
+        timetable_import = TimetableImport.objects.filter(pk=import_id, user=user).first() \
+            if str(import_id).isdigit() else None
+        if timetable_import is None:
+            return JsonResponse(status=status.HTTP_404_NOT_FOUND, data="Import not found", safe=False)
+        if not is_resumable(timetable_import):
+            return JsonResponse(status=status.HTTP_400_BAD_REQUEST,
+                                data="Only failed or stale running import can be resumed", safe=False)
+        tasks.import_timetable.delay(timetable_import.pk)
+        return JsonResponse(status=status.HTTP_202_ACCEPTED, data=TimetableImportSerializer(timetable_import).data,
+                            safe=False)
+
+    @action(detail=False, methods=['post'], url_path='import')
+    def import_timetable(self, request, *args, **kwargs):
+        """
+        Endpoint for importing rides from timetable file (CSV or JSONL, see utils.imports), available for company
+        users. File is imported in background, failed or stale running import (see utils.imports.is_resumable)
+        can be resumed by sending its import_id without file.
+        :return: import with its progress
+        """
+        user = request.user
+        if user.private:
+            return JsonResponse(status=status.HTTP_405_METHOD_NOT_ALLOWED,
+                                data="Only company users can import timetables", safe=False)
+
+        uploaded_file = request.FILES.get('file')
+        if uploaded_file is None:
+            if 'import_id' in request.data:
+                return self._resume_import(request.data['import_id'], user)
+            return JsonResponse(status=status.HTTP_400_BAD_REQUEST, data="Missing parameter 'file'", safe=False)
+
+        import_format = request.data.get('format') or file_format(uploaded_file.name)
+        if import_format not in TimetableImport.Format.values:
+            return JsonResponse(status=status.HTTP_400_BAD_REQUEST, data="Invalid file format", safe=False)
+
+        timetable_import = TimetableImport.objects.create(user=user, format=import_format, uploaded=True,
+                                                          path=save_upload(uploaded_file, import_format))
+        tasks.import_timetable.delay(timetable_import.pk)
+        return JsonResponse(status=status.HTTP_202_ACCEPTED, data=TimetableImportSerializer(timetable_import).data,
+                            safe=False)
+
+    @action(detail=False, methods=['get'], url_path=r'import/(?P<import_id>[0-9]+)')
+    def import_status(self, request, import_id=None, *args, **kwargs):
+        """
+        Endpoint for getting progress of timetable import.
+        """
+        timetable_import = TimetableImport.objects.filter(pk=import_id, user=request.user).first()
+        if timetable_import is None:
+            return JsonResponse(status=status.HTTP_404_NOT_FOUND, data="Import not found", safe=False)
+        return JsonResponse(status=status.HTTP_200_OK, data=TimetableImportSerializer(timetable_import).data,
+                            safe=False)
+
     def _has_ride_passengers(self) -> bool:
         return self.get_object().passengers.filter(
             passenger__decision__in=[Participation.Decision.ACCEPTED, Participation.Decision.PENDING]).exists()
@@ -121,7 +204,6 @@ class RideViewSet(viewsets.ModelViewSet):
             return JsonResponse(status=status.HTTP_405_METHOD_NOT_ALLOWED, data="User not allowed to update a ride",
                                 safe=False)
 
-    @validate_token
     def update(self, request, *args, **kwargs):
         """
         Endpoint for updating Ride object.
@@ -130,13 +212,12 @@ class RideViewSet(viewsets.ModelViewSet):
         :param kwargs:
         :return:
         """
-        user = kwargs['user']
+        user = request.user
 
         return self._update_ride(request=request, user=user)
 
-    @validate_token
     def destroy(self, request, *args, **kwargs):
-        user = kwargs['user']
+        user = request.user
 
         instance = self.get_object()
         if instance.driver == user:
@@ -162,9 +243,9 @@ class RideViewSet(viewsets.ModelViewSet):
 
         rides = filter_rides_by_cities(request, rides)
         filtered_rides = self.filter_queryset(rides)
-        return get_paginated_queryset(self, filtered_rides)
+        return conditional_get(request, filtered_rides, lambda: get_paginated_queryset(self, filtered_rides),
+                               etag_parts=(user.pk,))
 
-    @validate_token
     @action(detail=False, methods=['get'])
     def user_rides(self, request, *args, **kwargs):
         """
@@ -172,13 +253,12 @@ class RideViewSet(viewsets.ModelViewSet):
         :param request:
         :return: List of user's rides.
         """
-        user = kwargs['user']
+        user = request.user
         return self._get_user_rides(request, user)
 
-    @validate_token
     @action(detail=True, methods=['get'])
     def check_edition_permissions(self, request, *args, **kwargs):
-        user = kwargs['user']
+        user = request.user
 
         instance = self.get_object()
         if instance.driver == user:
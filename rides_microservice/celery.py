@@ -5,11 +5,14 @@ import os
 import django
 import kombu
 from celery import Celery, bootsteps
+from kombu.common import ignore_errors
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'rides_microservice.settings')
 django.setup()
 
-from utils.celery_utils import create_user, create_vehicle, delete_vehicle
+from django.conf import settings
+
+from utils.celery_utils import MessageBatch
 
 app = Celery('rides_microservice')
 
@@ -17,92 +20,97 @@ app.config_from_object('django.conf:settings', namespace='CELERY')
 app.autodiscover_tasks()
 
 # setting publisher
-with app.pool.acquire(block=True) as conn:
-    exchange_main = kombu.Exchange(
-        name='trawell_exchange',
-        type='direct',
-        durable=True,
-        channel=conn,
-    )
-
-    exchange_main.declare()
-
-    queue_notify = kombu.Queue(
-        name='notifications',
-        exchange=exchange_main,
-        routing_key='notify',
-        channel=conn,
-        message_ttl=600,
-        queue_arguments={
-            'x-queue_rides-type': 'classic'
-        },
-        durable=True
-    )
-    queue_notify.declare()
-
-    queue_reviews = kombu.Queue(
-        name='reviews',
-        exchange=exchange_main,
-        routing_key='review',
-        channel=conn,
-        message_ttl=600,
-        queue_arguments={
-            'x-queue_rides-type': 'classic'
-        },
-        durable=True
-    )
-    queue_reviews.declare()
-
-    queue_rides = kombu.Queue(
-        name='rides',
-        exchange=exchange_main,
-        routing_key='send',
-        channel=conn,
-        message_ttl=600,
-        queue_arguments={
-            'x-queue_rides-type': 'classic'
-        },
-        durable=True
-    )
-    queue_rides.declare()
-
-    queue_history = kombu.Queue(
-        name='history',
-        exchange=exchange_main,
-        routing_key='history',
-        channel=conn,
-        x_message_ttl=600,
-        queue_arguments={
-            'x-queue_rides-type': 'classic',
-            'x-message-ttl': 600000,
-        },
-        durable=True
-    )
-    queue_history.declare()
+# Exchange and queues are not bound to any connection here, so importing this module does not touch the broker.
+# They are declared on first publish from each connection (see declare_topology).
+exchange_main = kombu.Exchange(
+    name='trawell_exchange',
+    type='direct',
+    durable=True,
+)
+
+queue_notify = kombu.Queue(
+    name='notifications',
+    exchange=exchange_main,
+    routing_key='notify',
+    message_ttl=600,
+    queue_arguments={
+        'x-queue_rides-type': 'classic'
+    },
+    durable=True
+)
+
+queue_reviews = kombu.Queue(
+    name='reviews',
+    exchange=exchange_main,
+    routing_key='review',
+    message_ttl=600,
+    queue_arguments={
+        'x-queue_rides-type': 'classic'
+    },
+    durable=True
+)
+
+queue_rides = kombu.Queue(
+    name='rides',
+    exchange=exchange_main,
+    routing_key='send',
+    message_ttl=600,
+    queue_arguments={
+        'x-queue_rides-type': 'classic'
+    },
+    durable=True
+)
+
+queue_history = kombu.Queue(
+    name='history',
+    exchange=exchange_main,
+    routing_key='history',
+    x_message_ttl=600,
+    queue_arguments={
+        'x-queue_rides-type': 'classic',
+        'x-message-ttl': 600000,
+    },
+    durable=True
+)
+
+TOPOLOGY = [exchange_main, queue_notify, queue_reviews, queue_rides, queue_history]
 
 
 # setting consumer
 class MyConsumerStep(bootsteps.ConsumerStep):
 
+    def __init__(self, parent, **kwargs):
+        super().__init__(parent, **kwargs)
+        self.batch = MessageBatch(size=settings.RIDES_CONSUMER_BATCH_SIZE)
+        self.flush_timer = None
+
     def get_consumers(self, channel):
         return [kombu.Consumer(channel,
                                queues=[queue_rides],
                                callbacks=[self.handle_message],
-                               accept=['json'])]
+                               accept=['json'],
+                               prefetch_count=settings.RIDES_CONSUMER_PREFETCH)]
 
-    def handle_message(self, body, message):
-        print('Received message: {0!r}'.format(body))
-        print(message)
-        if body['title'] == 'users':
-            create_user(body['message'])
+    def start(self, c):
+        super().start(c)
+        self.flush_timer = c.timer.call_repeatedly(settings.RIDES_CONSUMER_FLUSH_INTERVAL, self.batch.flush)
 
-        if body['title'] == 'vehicles.create':
-            create_vehicle(body['message'])
+    def stop(self, c):
+        self._flush(c)
+        super().stop(c)
 
-        if body['title'] == 'vehicles.delete':
-            delete_vehicle(body['message'])
+    def shutdown(self, c):
+        self._flush(c)
+        super().shutdown(c)
 
-        message.ack()
+    def _flush(self, c):
+        if self.flush_timer is not None:
+            self.flush_timer.cancel()
+            self.flush_timer = None
+        ignore_errors(c.connection, self.batch.flush)
+
+    def handle_message(self, body, message):
+        self.batch.add(body, message)
 
 
 app.steps['consumer'].add(MyConsumerStep)
@@ -1,48 +1,293 @@
 from __future__ import absolute_import, unicode_literals
 import datetime
+import logging
+import uuid
 
-from celery import shared_task
-from rides_microservice.celery import app, queue_reviews, queue_history
-from rides.serializers import RideSerializer, RideForHistorySerializer, RideForReviewsSerializer
-from django.db.models import Q
-from rides.models import Ride
+from django.conf import settings
+from rides_microservice.celery import app, TOPOLOGY
+from rides.serializers import RideForHistorySerializer, RideForReviewsSerializer
+from django.db import transaction, connection
+from django.db.models import Q, Prefetch, F
+from django.utils import timezone
+from rides.models import Ride, Participation
+from users.models import ProcessedMessage, IdempotentResponse
+from utils.messaging import encode_event, publish_encoded, bulk_rides_message, queryset_chunks
+from utils import snapshots
+from utils.metrics import timed, increment
 
+logger = logging.getLogger(__name__)
 
-@shared_task(name='data_messaging')
-def publish_message(message, title, queue, routing_key):
-    body = {
-        'title': title,
-        'message': message
-    }
+
+def publish_fanout(message, title: str, routing_keys: list):
+    """
+    Serialises message once and publishes it to every given routing key over a single acquired producer.
+
+    :param message: message content
+    :param title: event title
+    :param routing_keys: routing keys of the queues the message is delivered to
+    """
+    with timed('events.encode', title=title) as stats:
+        encoded = encode_event(message, title)
+        stats['bytes'] = len(encoded.payload)
+
+    with app.producer_pool.acquire(block=True) as producer:
+        with timed('events.publish', title=title, queues=len(routing_keys)):
+            publish_encoded(producer, encoded, routing_keys, declare=TOPOLOGY)
+
+
+def publish_chunks(chunks, title: str, routing_keys: list):
+    """
+    Publishes event with many rides split into chunks, each chunk is a separate message. Every message has
+    'chunk' entry with stream id, sequence number and 'last' marker set on the final message of the stream.
+    Chunk with encoded size over EVENTS_CHUNK_MAX_BYTES is split in halves.
+    Event without any rides is published as a single empty chunk.
+
+    :param chunks: iterable of lists with serialised rides
+    :param title: event title
+    :param routing_keys: routing keys of the queues the messages are delivered to
+    """
+    stream = uuid.uuid4().hex
+    seq = 0
+    pending = []
     with app.producer_pool.acquire(block=True) as producer:
-        producer.publish(
-            body,
-            exchange='trawell_exchange',
-            queue=queue,
-            routing_key=routing_key,
-        )
+        for chunk in chunks:
+            if pending:
+                seq = _publish_chunk(producer, pending, title, routing_keys, stream, seq, last=False)
+            pending = chunk
+        _publish_chunk(producer, pending, title, routing_keys, stream, seq, last=True)
+
+
+def _publish_chunk(producer, rides, title: str, routing_keys: list, stream: str, seq: int, last: bool) -> int:
+    with timed('events.encode', title=title, seq=seq) as stats:
+        encoded = encode_event(bulk_rides_message(rides), title, chunk={'stream': stream, 'seq': seq, 'last': last})
+        stats['bytes'] = len(encoded.payload)
+
+    if len(encoded.payload) > settings.EVENTS_CHUNK_MAX_BYTES and len(rides) > 1:
+        half = len(rides) // 2
+        seq = _publish_chunk(producer, rides[:half], title, routing_keys, stream, seq, last=False)
+        return _publish_chunk(producer, rides[half:], title, routing_keys, stream, seq, last=last)
+
+    with timed('events.publish', title=title, queues=len(routing_keys)):
+        publish_encoded(producer, encoded, routing_keys, declare=TOPOLOGY)
+    return seq + 1
+
+
+def _write_snapshot(rides: list, title: str, routing_keys: list):
+    with timed('rides.snapshot', title=title, rides=len(rides)):
+        for routing_key in routing_keys:
+            snapshots.write_chunk(title, routing_key, rides)
+
+
+def republish_snapshot(title: str, routing_key: str, first_ride_id: int or None = None,
+                       last_ride_id: int or None = None):
+    """
+    Publishes again rides from local snapshot of given event stream (see utils.snapshots), ex. when history
+    service lost messages. Rides are read from snapshot files only, database is not used.
+
+    :param title: title of snapshotted event (rides.archive or rides.sync)
+    :param routing_key: routing key the rides were published to
+    :param first_ride_id: first ride id of the range or None
+    :param last_ride_id: last ride id of the range or None
+    """
+    publish_chunks(snapshots.read_chunks(title, routing_key, settings.EVENTS_CHUNK_SIZE, first_ride_id, last_ride_id),
+                   title, [routing_key])
+
+
+def publish_stream(queryset, serializer_class, title: str, routing_keys: list):
+    """
+    Publishes rides from queryset as chunked event, see publish_chunks.
+    Queryset is iterated in chunks of EVENTS_CHUNK_SIZE, so memory use does not depend on number of rides.
+    """
+    publish_chunks(queryset_chunks(queryset, serializer_class, settings.EVENTS_CHUNK_SIZE), title, routing_keys)
+
+
+def archive_candidates():
+    return Ride.objects.filter(Q(start_date__lte=timezone.now()) | Q(is_cancelled=True), was_archived=False)
+
+
+def archived_rides(ride_ids: list):
+    """
+    Returns rides with given ids together with all related objects needed by RideForReviewsSerializer
+    and RideForHistorySerializer, so serialising a chunk takes a constant number of queries.
+    """
+    return Ride.all_objects.filter(ride_id__in=ride_ids).order_by('ride_id').select_related(
+        'city_from', 'city_to', 'driver', 'vehicle__user', 'recurrent_ride__city_from', 'recurrent_ride__city_to',
+        'recurrent_ride__driver', 'recurrent_ride__vehicle',
+    ).prefetch_related(Prefetch('participation_set', queryset=Participation.objects.select_related('user')),
+                       'passengers')
+
+
+def next_ids(queryset, after: int, chunk_size: int) -> list:
+    """
+    Returns at most chunk_size ids of rides from queryset greater than given id (keyset pagination).
+    """
+    return list(queryset.filter(ride_id__gt=after).order_by('ride_id').values_list('ride_id', flat=True)[:chunk_size])
+
+
+ARCHIVE_STREAMS = [(RideForReviewsSerializer, ['review']), (RideForHistorySerializer, ['history'])]
+
+
+def archive_rides(candidates) -> int:
+    """
+    Publishes rides from candidates queryset to reviews and history services and marks them as archived.
+    Rides are processed in chunks of EVENTS_CHUNK_SIZE ids. Every chunk is locked, serialised and marked
+    with a single update in a short transaction and it is written to snapshot and published only after
+    the transaction is committed, so a failed update never leaves published or snapshotted rides that would be
+    published again by the next run. Snapshot is written before publishing, so rides lost by a failed publish
+    can be published again with republish_snapshot.
+    Rides locked by another archiving task are skipped, memory use does not depend on number of rides waiting
+    for archiving. Nothing is published if there are no rides to archive.
+
+    :param candidates: queryset with rides to archive
+    :return: number of archived rides
+    """
+    chunk_size = settings.EVENTS_CHUNK_SIZE
+    streams = [[serializer_class, routing_keys, uuid.uuid4().hex, 0] for serializer_class, routing_keys in
+               ARCHIVE_STREAMS]
+    archived = 0
+
+    ride_ids = next_ids(candidates, 0, chunk_size)
+    if not ride_ids:
+        return archived
+
+    with app.producer_pool.acquire(block=True) as producer:
+        while ride_ids:
+            following_ids = next_ids(candidates, ride_ids[-1], chunk_size)
+            last = not following_ids
+            with transaction.atomic():
+                claimed_ids = list(Ride.objects.select_for_update(skip_locked=True)
+                                   .filter(ride_id__in=ride_ids, was_archived=False)
+                                   .values_list('ride_id', flat=True))
+                rides = list(archived_rides(claimed_ids)) if claimed_ids else []
+                chunks = []
+                for stream in streams:
+                    serializer_class, routing_keys, stream_id, seq = stream
+                    if rides or (last and seq):
+                        chunks.append((stream, serializer_class(rides, many=True).data))
+                with timed('rides.archive.update', rides=len(claimed_ids)):
+                    Ride.objects.filter(ride_id__in=claimed_ids).update(was_archived=True, version=F('version') + 1,
+                                                                        updated_at=timezone.now())
+
+            for stream, data in chunks:
+                _, routing_keys, stream_id, seq = stream
+                _write_snapshot(data, 'rides.archive', routing_keys)
+                stream[3] = _publish_chunk(producer, data, 'rides.archive', routing_keys, stream_id, seq, last=last)
+            increment('rides.archived', len(claimed_ids))
+            archived += len(claimed_ids)
+            ride_ids = following_ids
+    return archived
+
 
 @app.task(queue='archive_queue')
 def archive():
-    current_time = datetime.datetime.now()
-    rides = Ride.objects.filter(Q(start_date__lte=current_time) | Q(is_cancelled=True), was_archived=False)
-    history_serializer = RideForHistorySerializer(instance=rides, many=True)
-    reviews_serializer = RideForReviewsSerializer(instance=rides, many=True)
+    """
+    Sweeper run by celery beat every RIDES_ARCHIVE_SWEEP_INTERVAL seconds. Rides are archived by tasks scheduled
+    when they are created, updated or cancelled, the sweeper archives rides that were missed (ex. when the task
+    was lost) and schedules archiving of rides starting before its next runs. Rides starting before its next run
+    were already scheduled by the previous run or when they were saved, so they are not scheduled again.
+    """
+    archive_rides(archive_candidates())
+    next_run = timezone.now() + datetime.timedelta(seconds=settings.RIDES_ARCHIVE_SWEEP_INTERVAL)
+    schedule_archive(Ride.objects.filter(start_date__gt=next_run, is_cancelled=False))
 
-    publish_message(reviews_serializer.data, 'rides.archive', queue_reviews, 'review')
-    publish_message(history_serializer.data, 'rides.archive', queue_history, 'history')
 
-    for ride in rides:
-        ride.was_archived = True
-        ride.save()
+@app.task(queue='archive_queue')
+def archive_selected(ride_ids: list):
+    archive_rides(archive_candidates().filter(ride_id__in=ride_ids))
 
 
-@app.task(queue='archive_queue')
+def schedule_archive(rides) -> None:
+    """
+    Schedules archiving of given rides. Cancelled and already started rides are archived right away, rides starting
+    within two sweeper intervals are archived by task with eta at their start, the rest is scheduled by the sweeper.
+    Task archives only rides which are due when it runs, so rides rescheduled to later dates are left for later tasks.
+
+    :param rides: queryset with rides
+    """
+    now = timezone.now()
+    horizon = now + datetime.timedelta(seconds=2 * settings.RIDES_ARCHIVE_SWEEP_INTERVAL)
+    due = {}
+    for ride_id, start_date, is_cancelled in rides.filter(Q(start_date__lte=horizon) | Q(is_cancelled=True),
+                                                          was_archived=False).values_list('ride_id', 'start_date',
+                                                                                          'is_cancelled'):
+        eta = now if is_cancelled or start_date <= now else start_date
+        due.setdefault(eta, []).append(ride_id)
+
+    for eta, ride_ids in due.items():
+        archive_selected.apply_async((ride_ids,), eta=eta)
+
+
+def purge_rides(ride_ids: list) -> int:
+    """
+    Deletes archived rides with given ids in a single transaction. Participations are detached from the rides
+    with plain SQL instead of Django collector, which would load all of them into memory.
+
+    :param ride_ids: ids of rides to delete
+    :return: number of deleted rides
+    """
+    quote_name = connection.ops.quote_name
+    participations_table = quote_name(Participation._meta.db_table)
+    rides_table = quote_name(Ride._meta.db_table)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'UPDATE {participations_table} SET ride_id = NULL WHERE ride_id = ANY(%s)', [ride_ids])
+        cursor.execute(f'DELETE FROM {rides_table} WHERE ride_id = ANY(%s) AND was_archived', [ride_ids])
+        return cursor.rowcount
+
+
+@app.task(queue='archive_queue', acks_late=True)
 def clear_from_archived():
-    rides = Ride.objects.filter(was_archived=True)
+    """
+    Sends archived rides to history service and deletes them, in chunks of EVENTS_CHUNK_SIZE rides.
+    Every chunk is deleted in its own short transaction right after it is published, so interrupted purge
+    can be simply run again and continues with rides that are left.
+    """
+    chunk_size = settings.EVENTS_CHUNK_SIZE
+    candidates = Ride.all_objects.filter(was_archived=True)
+    total = candidates.count()
+    if not total:
+        return
+
+    stream, seq, purged = uuid.uuid4().hex, 0, 0
+    with app.producer_pool.acquire(block=True) as producer:
+        ride_ids = next_ids(candidates, 0, chunk_size)
+        while ride_ids:
+            following_ids = next_ids(candidates, ride_ids[-1], chunk_size)
+            rides = RideForHistorySerializer(archived_rides(ride_ids), many=True).data
+            _write_snapshot(rides, 'rides.sync', ['history'])
+            seq = _publish_chunk(producer, rides, 'rides.sync', ['history'], stream, seq, last=not following_ids)
+            with timed('rides.purge', rides=len(ride_ids)):
+                deleted = purge_rides(ride_ids)
+            increment('rides.purged', deleted)
+            purged += deleted
+            logger.info('Purged %d of %d archived rides', purged, total)
+            ride_ids = following_ids
+
+
+@app.task(queue='archive_queue')
+def clear_processed_messages():
+    window_start = timezone.now() - datetime.timedelta(seconds=settings.RIDES_DEDUP_WINDOW)
+    ProcessedMessage.objects.filter(processed_at__lt=window_start).delete()
+
+
+@app.task(queue='archive_queue')
+def clear_idempotent_responses():
+    window_start = timezone.now() - datetime.timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+    IdempotentResponse.objects.filter(created_at__lt=window_start).delete()
 
-    serializer = RideForHistorySerializer(instance=rides, many=True)
-    publish_message(serializer.data, 'rides.sync', queue_history, 'history')
 
-    rides.delete()
+@app.task
+def import_timetable(import_id: int):
+    """
+    Imports rides from uploaded timetable file, see utils.imports.run_import. Import which is already running
+    or completed is skipped.
+    """
+    # imported here, because utils.services imports this module
+    from utils.imports import claim_import, run_import
 
+    timetable_import = claim_import(import_id)
+    if timetable_import is None:
+        logger.info('Timetable import %s is already running or completed', import_id)
+        return
+    run_import(timetable_import)
+    logger.info('Timetable import %s completed: %s rides created, %s rows failed', import_id,
+                timetable_import.created_rides, timetable_import.failed_rows)
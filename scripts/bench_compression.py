@@ -0,0 +1,45 @@
+import random
+import string
+import time
+
+from scripts.bench_publishing import ride_payload
+from utils.compression import CODECS, compress
+from utils.renderers import dumps
+
+REPEATS = 200
+
+
+def _ride(rng: random.Random, ride_id: int) -> dict:
+    # rides differ in the values users enter, so repeated payloads do not compress unrealistically well
+    ride = ride_payload(ride_id)
+    ride.update({'description': ''.join(rng.choices(string.ascii_letters + ' ', k=rng.randint(0, 200))),
+                 'price': f'{rng.uniform(5, 200):.2f}', 'area_from': ''.join(rng.choices(string.ascii_letters, k=12)),
+                 'start_date': f'2022-12-{rng.randint(1, 28):02}T{rng.randint(0, 23):02}:{rng.randint(0, 59):02}:00Z'})
+    return ride
+
+
+def payloads() -> dict:
+    rng = random.Random(0)
+    details = _ride(rng, 1)
+    details['coordinates'] = [{'lat': f'{50 + i / 1000:.6f}', 'lng': f'{19 + i / 700:.6f}', 'sequence_no': i}
+                              for i in range(500)]
+    page = {'page_size': 20, 'count': 1000, 'results': [_ride(rng, ride_id) for ride_id in range(20)]}
+    recurrent = [dict(_ride(rng, ride_id), recurrent=True) for ride_id in range(200)]
+    return {'ride details': dumps(details), 'rides page': dumps(page), 'recurrent rides': dumps(recurrent)}
+
+
+def run():
+    for name, body in payloads().items():
+        print(f'{name}: {len(body)} bytes')
+        for encoding in CODECS:
+            start = time.perf_counter()
+            for _ in range(REPEATS):
+                compressed = compress(body, encoding)
+            elapsed = time.perf_counter() - start
+            print(f'{encoding:>6}: {elapsed / REPEATS * 1000:7.3f} ms, {len(compressed):7} bytes '
+                  f'({len(compressed) / len(body):.1%}), {(len(body) - len(compressed)) / elapsed * REPEATS / 2 ** 20:8.1f} '
+                  f'MB saved per CPU second')
+
+
+if __name__ == '__main__':
+    run()
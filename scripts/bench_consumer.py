@@ -0,0 +1,65 @@
+import socket
+import time
+
+import kombu
+from django.db import transaction
+
+from utils.celery_utils import MessageBatch, process_message
+
+MESSAGES = 5000
+BATCH_SIZE = 100
+FIRST_USER_ID = 10 ** 7
+
+
+def user_message(user_id: int) -> dict:
+    return {'title': 'users',
+            'message': {'user_id': user_id, 'first_name': 'Anna', 'last_name': 'Sowa',
+                        'email': f'bench{user_id}@trawell.com', 'avatar': '', 'user_type': 'private',
+                        'avg_rate': '4.50'}}
+
+
+def _fill(connection, queue):
+    with connection.Producer() as producer:
+        for user_id in range(FIRST_USER_ID, FIRST_USER_ID + MESSAGES):
+            producer.publish(user_message(user_id), exchange=queue.exchange, routing_key=queue.routing_key,
+                             declare=[queue])
+
+
+def _drain(connection, queue, callback):
+    # in-memory transport ignores multiple acks, so prefetch limit is not set here
+    with connection.Consumer(queue, callbacks=[callback], accept=['json']):
+        while True:
+            try:
+                connection.drain_events(timeout=0.1)
+            except socket.timeout:
+                return
+
+
+def _one_by_one(body, message):
+    process_message(body)
+    message.ack()
+
+
+def _measure(name, callback, flush=None):
+    exchange = kombu.Exchange('trawell_exchange', type='direct')
+    queue = kombu.Queue('rides', exchange=exchange, routing_key='send')
+    with kombu.Connection('memory://') as connection, transaction.atomic():
+        _fill(connection, queue)
+        start = time.perf_counter()
+        _drain(connection, queue, callback)
+        if flush is not None:
+            flush()
+        elapsed = time.perf_counter() - start
+        transaction.set_rollback(True)
+
+    print(f'{name:>12}: {MESSAGES} messages in {elapsed:.2f} s, {MESSAGES / elapsed:.0f} messages/s')
+
+
+def run():
+    _measure('one by one', _one_by_one)
+    batch = MessageBatch(size=BATCH_SIZE)
+    _measure('batched', batch.add, batch.flush)
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,46 @@
+import datetime
+import time
+
+from scripts.bench_publishing import ride_payload
+from utils.messaging import build_body, encode_body, compact_rides
+
+SERIES_LENGTHS = [100, 1000, 5000]
+REPEATS = 5
+
+
+def recurrent_series(length: int) -> list:
+    start_date = datetime.datetime(2022, 12, 20, 20)
+    rides = []
+    for ride_id in range(length):
+        ride = ride_payload(ride_id)
+        ride.update({'recurrent': True, 'passengers': [], 'coordinates': [],
+                     'start_date': (start_date + datetime.timedelta(days=ride_id)).isoformat() + 'Z'})
+        rides.append(ride)
+    return rides
+
+
+def _measure(rides: list, compact: bool, serializer: str, compression_method: str or None) -> (int, float):
+    best = None
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        message = compact_rides(rides) if compact else rides
+        encoded = encode_body(build_body(message, 'rides.create.many'), serializer=serializer,
+                              compression_method=compression_method)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(encoded.payload), best
+
+
+def run():
+    variants = [('json', False, 'json', None), ('compact json', True, 'json', None),
+                ('compact msgpack', True, 'msgpack', None), ('compact msgpack+zlib', True, 'msgpack', 'zlib')]
+    for length in SERIES_LENGTHS:
+        rides = recurrent_series(length)
+        print(f'rides.create.many with {length} rides')
+        for name, compact, serializer, compression_method in variants:
+            size, elapsed = _measure(rides, compact, serializer, compression_method)
+            print(f'{name:>22}: {size:>10} bytes, {elapsed * 1000:8.2f} ms')
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,60 @@
+import time
+
+import kombu
+
+from utils.messaging import build_body, encode_body, publish_encoded, EXCHANGE_NAME
+
+ROUTING_KEYS = ['notify', 'review']
+EVENTS = 2000
+
+
+def ride_payload(ride_id: int) -> dict:
+    user = {'user_id': 1, 'email': 'anna@sowa.com', 'first_name': 'Anna', 'last_name': 'Sowa', 'avg_rate': '4.50',
+            'avatar': '', 'private': True}
+    city = {'city_id': 1, 'name': 'Kraków', 'county': 'Kraków', 'state': 'Lesser Poland Voivodeship',
+            'lat': '50.0619474', 'lng': '19.9368564'}
+    return {'ride_id': ride_id, 'city_from': city, 'city_to': city, 'area_from': 'Rondo Mogilskie',
+            'area_to': 'Dworzec', 'start_date': '2022-12-20T20:00:00Z', 'price': '20.50', 'seats': 3,
+            'recurrent': False, 'automatic_confirm': False, 'description': 'lalala', 'driver': user,
+            'vehicle': {'vehicle_id': 1, 'make': 'Skoda', 'model': 'Fabia', 'color': 'red'},
+            'duration': {'hours': 1, 'minutes': 0}, 'available_seats': 3,
+            'passengers': [{'id': 1, 'user': user, 'decision': 'accepted'}] * 3,
+            'coordinates': [{'lat': '50.061947', 'lng': '19.936856', 'sequence_no': i} for i in range(50)]}
+
+
+def _per_queue(connection, payload):
+    for routing_key in ROUTING_KEYS:
+        with connection.Producer() as producer:
+            producer.publish(build_body(payload, 'rides.create'), exchange=EXCHANGE_NAME, routing_key=routing_key)
+
+
+def _fanout(connection, payload):
+    encoded = encode_body(build_body(payload, 'rides.create'))
+    with connection.Producer() as producer:
+        publish_encoded(producer, encoded, ROUTING_KEYS)
+
+
+def _measure(name, publish):
+    with kombu.Connection('memory://') as connection:
+        exchange = kombu.Exchange(EXCHANGE_NAME, type='direct')
+        for routing_key in ROUTING_KEYS:
+            kombu.Queue(routing_key, exchange=exchange, routing_key=routing_key, channel=connection).declare()
+
+        payloads = [ride_payload(ride_id) for ride_id in range(EVENTS)]
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        for payload in payloads:
+            publish(connection, payload)
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+
+    print(f'{name:>10}: {EVENTS} events, {wall / EVENTS * 1e6:8.1f} us wall/event, '
+          f'{cpu / EVENTS * 1e6:8.1f} us cpu/event')
+
+
+def run():
+    _measure('per queue', _per_queue)
+    _measure('fan-out', _fanout)
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,31 @@
+import time
+
+from django.http import JsonResponse as DjangoJsonResponse
+from rest_framework.renderers import JSONRenderer
+
+from scripts.bench_publishing import ride_payload
+from utils.renderers import JsonResponse, ORJSONRenderer
+
+PAGE_SIZE = 100
+REPEATS = 500
+
+
+def _measure(name, render, page):
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        size = len(render(page))
+    elapsed = time.perf_counter() - start
+    print(f'{name:>22}: {elapsed / REPEATS * 1000:7.3f} ms/page, {size} bytes')
+
+
+def run():
+    page = {'page_size': PAGE_SIZE, 'count': 1000, 'results': [ride_payload(ride_id) for ride_id in range(PAGE_SIZE)]}
+
+    _measure('DRF JSONRenderer', JSONRenderer().render, page)
+    _measure('ORJSONRenderer', ORJSONRenderer().render, page)
+    _measure('django JsonResponse', lambda data: DjangoJsonResponse(data).content, page)
+    _measure('orjson JsonResponse', lambda data: JsonResponse(data).content, page)
+
+
+if __name__ == '__main__':
+    run()
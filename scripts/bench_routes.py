@@ -0,0 +1,42 @@
+import math
+import time
+
+from rides.serializers import RouteField, route_fields
+from utils.renderers import dumps
+
+POINTS = 2000
+REPEATS = 50
+
+
+def gps_trace() -> list:
+    # dense trace of a curvy road sampled every ~5 m with a few metres of GPS noise
+    return [(f'{50.06 + i * 0.00004 + math.sin(i / 50) * 0.002 + math.sin(i * 7.1) * 0.00002:.6f}',
+             f'{19.93 + i * 0.00005 + math.cos(i / 80) * 0.003 + math.cos(i * 5.3) * 0.00002:.6f}')
+            for i in range(POINTS)]
+
+
+def _measure(name, fields):
+    field = RouteField()
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        body = dumps(field.to_representation(fields['route']))
+    elapsed = time.perf_counter() - start
+    print(f'{name:>16}: {fields["route_points"]:5} points, {len(fields["route"]):6} bytes stored, '
+          f'{len(body):7} bytes in response, {elapsed / REPEATS * 1000:6.2f} ms to serialise')
+
+
+def run():
+    from django.test import override_settings
+
+    trace = gps_trace()
+    for tolerance in (0, 1, 5, 10, 25):
+        with override_settings(ROUTE_SIMPLIFY_TOLERANCE=tolerance):
+            start = time.perf_counter()
+            fields = route_fields(trace)
+            elapsed = time.perf_counter() - start
+        _measure(f'tolerance {tolerance} m', fields)
+        print(f'{"":>16}  simplified in {elapsed * 1000:.2f} ms')
+
+
+if __name__ == '__main__':
+    run()
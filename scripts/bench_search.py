@@ -0,0 +1,66 @@
+import datetime
+import time
+
+from django.db import connection, transaction
+
+from cities.models import City
+from rides.models import Ride
+from users.models import User
+
+CURRENT_RIDES = 2000
+HISTORICAL_VOLUMES = [0, 50000, 200000]
+REPEATS = 20
+BATCH_SIZE = 5000
+
+
+def _rides(count: int, city_from: City, city_to: City, driver: User, start: datetime.datetime, archived: bool):
+    return [Ride(city_from=city_from, city_to=city_to, driver=driver, start_date=start + datetime.timedelta(hours=i),
+                 price=20, seats=3, available_seats=3, was_archived=archived) for i in range(count)]
+
+
+def _search(manager, city_from: City, city_to: City):
+    return list(manager.filter(is_cancelled=False, start_date__gt=datetime.datetime.now(tz=datetime.timezone.utc),
+                               city_to=city_to, city_from=city_from, available_seats__gt=0)
+                .order_by('start_date').values_list('ride_id', flat=True)[:25])
+
+
+def _measure(manager, city_from: City, city_to: City) -> float:
+    best = None
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        _search(manager, city_from, city_to)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run():
+    now = datetime.datetime.now(tz=datetime.timezone.utc)
+    with transaction.atomic():
+        city_from = City.objects.create(name='Bench From', county='Bench', state='Bench', lat=50, lng=19)
+        city_to = City.objects.create(name='Bench To', county='Bench', state='Bench', lat=51, lng=20)
+        driver = User.objects.create(user_id=10 ** 8, first_name='Anna', last_name='Sowa', email='bench@trawell.com',
+                                     avg_rate=4.5)
+        Ride.objects.bulk_create(_rides(CURRENT_RIDES, city_from, city_to, driver, now, archived=False), BATCH_SIZE)
+
+        historical = 0
+        for volume in HISTORICAL_VOLUMES:
+            while historical < volume:
+                count = min(BATCH_SIZE, volume - historical)
+                # archived rides still wait for the nightly purge, dates are in the future to keep them in
+                # the searched range, so only was_archived condition separates them
+                Ride.objects.bulk_create(_rides(count, city_from, city_to, driver, now, archived=True), BATCH_SIZE)
+                historical += count
+            with connection.cursor() as cursor:
+                cursor.execute(f'ANALYZE {Ride._meta.db_table}')
+
+            current = _measure(Ride.objects, city_from, city_to)
+            every = _measure(Ride.all_objects, city_from, city_to)
+            print(f'{volume:>7} archived rides: current rides {current * 1000:6.2f} ms, '
+                  f'all rides {every * 1000:6.2f} ms')
+
+        transaction.set_rollback(True)
+
+
+if __name__ == '__main__':
+    run()
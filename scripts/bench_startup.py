@@ -0,0 +1,49 @@
+import subprocess
+import sys
+
+IMPORT_SCRIPT = '''
+import socket
+import time
+
+attempts = []
+
+
+def refuse(self, address, *args, **kwargs):
+    attempts.append(address)
+    raise ConnectionRefusedError(f'network used during import: {address}')
+
+
+socket.socket.connect = refuse
+socket.socket.connect_ex = refuse
+
+start = time.perf_counter()
+import django
+import os
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'rides_microservice.settings')
+django.setup()
+import rides_microservice.urls
+import rides_microservice.tasks
+elapsed = time.perf_counter() - start
+print(f'{elapsed * 1000:.1f} {len(attempts)}')
+'''
+
+RUNS = 5
+
+
+def run():
+    timings = []
+    for _ in range(RUNS):
+        result = subprocess.run([sys.executable, '-c', IMPORT_SCRIPT], capture_output=True, text=True)
+        if result.returncode != 0:
+            print(result.stderr)
+            return
+        elapsed, attempts = result.stdout.split()
+        timings.append(float(elapsed))
+        if int(attempts):
+            print(f'Import tried to open {attempts} network connections')
+    print(f'Web application import: best {min(timings):.1f} ms, worst {max(timings):.1f} ms, '
+          f'no network connections')
+
+
+if __name__ == '__main__':
+    run()
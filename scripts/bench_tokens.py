@@ -0,0 +1,64 @@
+import base64
+import os
+import time
+
+import jwt
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from django.db import transaction
+
+from users.models import User
+from utils import validate_token
+from utils.metrics import snapshot
+
+REQUESTS = 2000
+
+
+def _key_pair():
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    public_der = private_key.public_key().public_bytes(serialization.Encoding.DER,
+                                                       serialization.PublicFormat.SubjectPublicKeyInfo)
+    return private_key, base64.b64encode(public_der).decode()
+
+
+def _uncached(token):
+    public_key = f"""-----BEGIN PUBLIC KEY-----\n{os.environ.get("TOKEN_KEY")}\n-----END PUBLIC KEY-----"""
+    decoded_token = jwt.decode(token, public_key, algorithms=["RS256"], audience="account")
+    return User.objects.get(email=decoded_token['email'])
+
+
+def _cached_key(token):
+    return User.objects.get(email=validate_token.decode_token(token)['email'])
+
+
+def _cached_token(token):
+    # cached token still reads its user by primary key, only the signature check is skipped
+    return validate_token.resolve_user(token)
+
+
+def _measure(name, verify, token):
+    start = time.perf_counter()
+    for _ in range(REQUESTS):
+        verify(token)
+    elapsed = time.perf_counter() - start
+    print(f'{name:>12}: {elapsed / REQUESTS * 1e6:8.1f} us/request')
+
+
+def run():
+    private_key, os.environ['TOKEN_KEY'] = _key_pair()
+    token = jwt.encode({'email': 'anna@sowa.com', 'aud': 'account', 'exp': int(time.time()) + 3600}, private_key,
+                       algorithm='RS256')
+
+    with transaction.atomic():
+        User.objects.create(email='anna@sowa.com', first_name='Anna', last_name='Sowa', avg_rate=0)
+        _measure('uncached', _uncached, token)
+        _measure('cached key', _cached_key, token)
+        _measure('cached token', _cached_token, token)
+        transaction.set_rollback(True)
+    counters = snapshot()['counters']
+    hits, misses = counters['auth.token_cache.hit'], counters['auth.token_cache.miss']
+    print(f'token cache hit rate: {hits / (hits + misses):.1%}')
+
+
+if __name__ == '__main__':
+    run()
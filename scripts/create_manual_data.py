@@ -6,7 +6,6 @@ from recurrent_rides.models import RecurrentRide
 from rides.models import Ride, Participation
 from rides.serializers import RideSerializer, ParticipationSerializer
 from rides_microservice import tasks
-from rides_microservice.celery import queue_notify, queue_reviews
 from users.models import User
 from vehicles.models import Vehicle
 
@@ -114,8 +113,7 @@ def create_manual_rides(rides):
         new_ride.save()
 
         serializer = RideSerializer(new_ride)
-        tasks.publish_message(serializer.data, 'rides.create', queue_notify, 'notify')
-        tasks.publish_message(serializer.data, 'rides.create', queue_reviews, 'review')
+        tasks.publish_fanout(serializer.data, 'rides.create', ['notify', 'review'])
 
 
 def create_manual_participations(participations):
@@ -127,8 +125,7 @@ def create_manual_participations(participations):
                                                          decision=participation['decision'],
                                                          reserved_seats=participation['reserved_seats'])
 
-        tasks.publish_message(ParticipationSerializer(new_participation).data, 'participation', queue_notify, 'notify')
-        tasks.publish_message(ParticipationSerializer(new_participation).data, 'participation', queue_reviews, 'review')
+        tasks.publish_fanout(ParticipationSerializer(new_participation).data, 'participation', ['notify', 'review'])
 
 
 def create_manual_recurrent_rides(recurrent_rides):
@@ -162,8 +159,7 @@ def create_manual_recurrent_rides(recurrent_rides):
 
         rides = Ride.objects.filter(recurrent_ride=new_ride).all()
         serializer = RideSerializer(instance=rides, many=True)
-        tasks.publish_message(serializer.data, 'rides.create.many', queue_notify, 'notify')
-        tasks.publish_message(serializer.data, 'rides.create.many', queue_reviews, 'review')
+        tasks.publish_fanout(serializer.data, 'rides.create.many', ['notify', 'review'])
 
 
 scripts.create_cities.create()
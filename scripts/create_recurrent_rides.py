@@ -6,7 +6,6 @@ from recurrent_rides.factories import RecurrentRideFactory
 from rides.models import Ride
 from rides.serializers import RideSerializer
 from rides_microservice import tasks
-from rides_microservice.celery import queue_notify, queue_reviews
 from users.models import User
 
 
@@ -33,5 +32,4 @@ def create(amount):
 
             rides = Ride.objects.filter(recurrent_ride=ride).all()
             serializer = RideSerializer(instance=rides, many=True)
-            tasks.publish_message(serializer.data, 'rides.create.many', queue_notify, 'notify')
-            tasks.publish_message(serializer.data, 'rides.create.many', queue_reviews, 'review')
+            tasks.publish_fanout(serializer.data, 'rides.create.many', ['notify', 'review'])
@@ -4,7 +4,6 @@ import random
 from cities.models import City
 from rides.factories import RideWithPassengerFactory
 from rides_microservice import tasks
-from rides_microservice.celery import queue_notify, queue_reviews
 from users.models import User
 from rides.serializers import RideSerializer
 
@@ -30,5 +29,4 @@ def create(amount):
 
             ride = RideWithPassengerFactory(city_from=city_from, city_to=city_to, driver=driver, vehicle=vehicle, seats=seats, duration=duration)
 
-            tasks.publish_message(RideSerializer(ride).data, 'rides.create', queue_notify, 'notify')
-            tasks.publish_message(RideSerializer(ride).data, 'rides.create', queue_reviews, 'review')
+            tasks.publish_fanout(RideSerializer(ride).data, 'rides.create', ['notify', 'review'])
@@ -0,0 +1,44 @@
+import json
+import os
+import sys
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from jwt.algorithms import RSAAlgorithm
+
+DEFAULT_PORT = 8404
+
+
+def jwks_from_token_key(kid: str = 'local') -> dict:
+    """
+    Builds key set with the single key from TOKEN_KEY environment variable.
+    """
+    pem = f"""-----BEGIN PUBLIC KEY-----\n{os.environ.get("TOKEN_KEY")}\n-----END PUBLIC KEY-----"""
+    jwk = json.loads(RSAAlgorithm.to_jwk(RSAAlgorithm(RSAAlgorithm.SHA256).prepare_key(pem)))
+    jwk.update({'kid': kid, 'use': 'sig', 'alg': 'RS256'})
+    return {'keys': [jwk]}
+
+
+def serve(path: str or None = None, port: int = DEFAULT_PORT):
+    """
+    Serves key set from JWKS file (read again on every request, so keys can be rotated by editing the file)
+    or built from TOKEN_KEY, as a local stand-in for Keycloak certs endpoint.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if path:
+                with open(path, 'rb') as jwks_file:
+                    body = jwks_file.read()
+            else:
+                body = json.dumps(jwks_from_token_key()).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    HTTPServer(('127.0.0.1', port), Handler).serve_forever()
+
+
+if __name__ == '__main__':
+    serve(*sys.argv[1:2], *[int(port) for port in sys.argv[2:3]])
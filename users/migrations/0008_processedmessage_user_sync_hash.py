@@ -0,0 +1,27 @@
+# Generated by Django 4.1.1 on 2026-10-19 13:01
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0007_alter_user_email'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProcessedMessage',
+            fields=[
+                ('key', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('digest', models.CharField(blank=True, default='', max_length=40)),
+                ('processed_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='sync_hash',
+            field=models.CharField(blank=True, default='', max_length=40),
+        ),
+    ]
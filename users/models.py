@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 
 
 class User(models.Model):
@@ -9,3 +10,24 @@ class User(models.Model):
     avg_rate = models.DecimalField(max_digits=3, decimal_places=2)
     private = models.BooleanField(null=False, default=True)
     avatar = models.URLField(blank=True, default="")
+    sync_hash = models.CharField(max_length=40, blank=True, default="")
+
+
+class ProcessedMessage(models.Model):
+    key = models.CharField(max_length=100, primary_key=True)
+    digest = models.CharField(max_length=40, blank=True, default="")
+    processed_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+
+class IdempotentResponse(models.Model):
+    """
+    Response to the first request with given Idempotency-Key header, returned again for retries of the request.
+    Key is a hash of the user, request path and the header value. Response with status 0 is still being processed,
+    or it was abandoned when it is older than IDEMPOTENCY_PROCESSING_TIMEOUT.
+    """
+    key = models.CharField(max_length=64, primary_key=True)
+    request_digest = models.CharField(max_length=40)
+    status = models.PositiveSmallIntegerField(default=0)
+    content_type = models.CharField(max_length=100, blank=True, default="")
+    body = models.BinaryField(default=bytes)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
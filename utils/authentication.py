@@ -0,0 +1,93 @@
+import jwt
+from rest_framework import status
+from rest_framework.authentication import BaseAuthentication
+from rest_framework.exceptions import AuthenticationFailed, APIException
+from rest_framework.permissions import BasePermission
+from rest_framework.views import exception_handler
+
+from users.models import User
+from utils.renderers import JsonResponse
+from utils.validate_token import resolve_user
+
+
+class InvalidTokenProvided(AuthenticationFailed):
+    default_detail = 'Invalid token provided'
+
+
+class TokenDecodingFailure(AuthenticationFailed):
+    default_detail = 'Token decoding failure'
+
+
+class UserNotFound(APIException):
+    status_code = status.HTTP_404_NOT_FOUND
+    default_detail = 'User not found'
+
+
+TOKEN_ERRORS = (InvalidTokenProvided, TokenDecodingFailure, UserNotFound)
+
+
+class TokenAuthentication(BaseAuthentication):
+    """
+    Authenticates requests with bearer token from Authorization header. Request without the header is anonymous,
+    request with invalid token or token of unknown user is rejected.
+    """
+
+    def authenticate(self, request):
+        header = request.headers.get('Authorization')
+        if header is None:
+            return None
+
+        try:
+            token = header.split(' ')[1]
+        except IndexError:
+            raise InvalidTokenProvided()
+
+        try:
+            user = resolve_user(token)
+        except jwt.exceptions.DecodeError:
+            raise TokenDecodingFailure()
+        except User.DoesNotExist:
+            raise UserNotFound()
+        return user, token
+
+    def authenticate_header(self, request):
+        return 'Bearer'
+
+
+class IsTokenAuthenticated(BasePermission):
+    def has_permission(self, request, view):
+        if not isinstance(request.user, User):
+            raise InvalidTokenProvided()
+        return True
+
+
+class TokenAuthenticatedMixin:
+    """
+    Viewset mixin requiring token authentication for all actions except ones listed in public_actions.
+    Authenticated user is available as request.user, it is resolved once per request and only when needed,
+    so public actions do not verify the token at all.
+    """
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [IsTokenAuthenticated]
+    public_actions = ()
+
+    def perform_authentication(self, request):
+        pass
+
+    def get_permissions(self):
+        if self.action in self.public_actions or self.action == 'metadata':
+            return []
+        return super().get_permissions()
+
+
+def token_exception_handler(exc, context):
+    """
+    Returns token errors with the message as a plain JSON string, the same way views return other errors.
+    """
+    if isinstance(exc, TOKEN_ERRORS):
+        response = JsonResponse(data=str(exc.detail), status=exc.status_code, safe=False)
+        auth_header = getattr(exc, 'auth_header', None)
+        if auth_header:
+            response['WWW-Authenticate'] = auth_header
+        return response
+    return exception_handler(exc, context)
@@ -1,27 +1,64 @@
-from users.models import User
+import datetime
+import hashlib
+import json
+import logging
+from collections import OrderedDict
+from itertools import groupby
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from users.models import User, ProcessedMessage
 from vehicles.models import Vehicle
 
+logger = logging.getLogger(__name__)
+
+USER_FIELDS = ['first_name', 'last_name', 'email', 'avatar', 'private', 'avg_rate', 'sync_hash']
+VEHICLE_FIELDS = ['make', 'model', 'color', 'user', 'sync_hash']
+
+
+def payload_hash(data: dict) -> str:
+    """
+    Calculates hash of message content, that does not depend on keys order.
+    """
+    return hashlib.sha1(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _vehicle_hash(message: dict) -> str:
+    return payload_hash({'vehicle_id': message['vehicle_id'], 'make': message['make'], 'model': message['model'],
+                         'color': message['color'], 'user_id': message['user']['user_id']})
+
 
 def create_user(message):
-    is_private = True if message['user_type'] == 'private' else False
-    message['private'] = is_private
+    sync_hash = payload_hash(message)
+    user = User.objects.filter(user_id=message['user_id']).first()
+    if user is not None and user.sync_hash == sync_hash:
+        return user
+
     user, _ = User.objects.update_or_create(user_id=message['user_id'], defaults={'first_name': message['first_name'],
                                                                                   'last_name': message["last_name"],
                                                                                   'email': message["email"],
                                                                                   'avatar': message['avatar'],
                                                                                   'private': True if message[
                                                                                                          'user_type'] == 'private' else False,
-                                                                                  'avg_rate': message['avg_rate']})
+                                                                                  'avg_rate': message['avg_rate'],
+                                                                                  'sync_hash': sync_hash})
     return user
 
 
 def create_vehicle(message):
-    user_data = message.pop('user')
-    user = create_user(user_data)
+    sync_hash = _vehicle_hash(message)
+    user = create_user(message['user'])
+    vehicle = Vehicle.objects.filter(vehicle_id=message['vehicle_id'], user=user).first()
+    if vehicle is not None and vehicle.sync_hash == sync_hash:
+        return vehicle
+
     vehicle, _ = Vehicle.objects.update_or_create(vehicle_id=message['vehicle_id'], user=user,
                                                   defaults={'make': message['make'],
                                                             'model': message['model'],
                                                             'color': message['color'],
+                                                            'sync_hash': sync_hash,
                                                             })
     return vehicle
 
@@ -32,3 +69,217 @@ def delete_vehicle(message):
         vehicle.delete()
     except Vehicle.DoesNotExist:
         pass
+
+
+def _user_from_message(message: dict) -> User:
+    return User(user_id=message['user_id'], first_name=message['first_name'], last_name=message['last_name'],
+                email=message['email'], avatar=message['avatar'], private=message['user_type'] == 'private',
+                avg_rate=message['avg_rate'], sync_hash=payload_hash(message))
+
+
+def _vehicle_from_message(message: dict) -> Vehicle:
+    return Vehicle(vehicle_id=message['vehicle_id'], make=message['make'], model=message['model'],
+                   color=message['color'], user_id=message['user']['user_id'], sync_hash=_vehicle_hash(message))
+
+
+def _changed(model, objects: dict) -> list:
+    """
+    Returns objects which sync_hash differs from the stored one, rows with the same hash are not updated.
+
+    :param model: model class
+    :param objects: dictionary with objects to upsert by their primary keys
+    """
+    stored = dict(model.objects.filter(pk__in=objects.keys()).values_list('pk', 'sync_hash'))
+    return [obj for pk, obj in objects.items() if stored.get(pk) != obj.sync_hash]
+
+
+def upsert_users(messages: list) -> None:
+    """
+    Creates or updates users from many messages with a single query. When the same user comes
+    more than once, the last message wins. Users that did not change are skipped.
+    """
+    users = _changed(User, {message['user_id']: _user_from_message(message) for message in messages})
+    if users:
+        User.objects.bulk_create(users, update_conflicts=True, unique_fields=['user_id'], update_fields=USER_FIELDS)
+
+
+def upsert_vehicles(messages: list) -> None:
+    """
+    Creates or updates vehicles and their owners from many messages, with one query for users and one for vehicles.
+    Users and vehicles that did not change are skipped.
+    """
+    upsert_users([message['user'] for message in messages])
+    vehicles = _changed(Vehicle, {message['vehicle_id']: _vehicle_from_message(message) for message in messages})
+    if vehicles:
+        Vehicle.objects.bulk_create(vehicles, update_conflicts=True, unique_fields=['vehicle_id'],
+                                    update_fields=VEHICLE_FIELDS)
+
+
+def delete_vehicles(messages: list) -> None:
+    Vehicle.objects.filter(vehicle_id__in=[message['vehicle_id'] for message in messages]).delete()
+
+
+SINGLE_HANDLERS = {
+    'users': create_user,
+    'vehicles.create': create_vehicle,
+    'vehicles.delete': delete_vehicle,
+}
+
+BATCH_HANDLERS = {
+    'users': upsert_users,
+    'vehicles.create': upsert_vehicles,
+    'vehicles.delete': delete_vehicles,
+}
+
+
+def process_message(body: dict) -> None:
+    handler = SINGLE_HANDLERS.get(body['title'])
+    if handler is not None:
+        handler(body['message'])
+
+
+def process_batch(bodies: list) -> None:
+    """
+    Processes many messages. Consecutive messages with the same title are handled together by a bulk handler,
+    so the order of operations between different titles is kept.
+    """
+    for title, group in groupby(bodies, key=lambda body: body['title']):
+        handler = BATCH_HANDLERS.get(title)
+        if handler is not None:
+            handler([body['message'] for body in group])
+
+
+ENTITY_KEYS = {
+    'users': ('user', 'user_id'),
+    'vehicles.create': ('vehicle', 'vehicle_id'),
+    'vehicles.delete': ('vehicle', 'vehicle_id'),
+}
+
+
+def message_key(body: dict, message) -> (str, str):
+    """
+    Returns key and digest identifying message for deduplication. Message id is used if producer set it.
+    Otherwise the key is the synced entity (ex. user:12) and digest is the hash of the whole message, so only
+    repeated state of the entity is skipped and changes back to previous state are still applied.
+
+    :return: key and digest of the message
+    """
+    message_id = message.properties.get('message_id')
+    if message_id:
+        return f'id:{message_id}'[:100], ''
+
+    digest = payload_hash(body)
+    entity, id_field = ENTITY_KEYS.get(body.get('title'), (None, None))
+    try:
+        return f'{entity}:{body["message"][id_field]}', digest
+    except (KeyError, TypeError):
+        return f'hash:{digest}', ''
+
+
+class MessageDeduplicator:
+    """
+    Remembers keys of processed messages, so redelivered or replayed messages are skipped.
+    Recent keys are kept in bounded in-memory window, all keys from the last RIDES_DEDUP_WINDOW are kept
+    in ProcessedMessage table, so the window survives worker restarts.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self.recent = OrderedDict()
+
+    def stored(self, keys: list) -> dict:
+        """
+        Returns digests remembered for given keys.
+        """
+        found = {key: self.recent[key] for key in keys if key in self.recent}
+        not_found = [key for key in keys if key not in found]
+        if not_found:
+            window_start = timezone.now() - datetime.timedelta(seconds=settings.RIDES_DEDUP_WINDOW)
+            found.update(ProcessedMessage.objects.filter(key__in=not_found, processed_at__gte=window_start)
+                         .values_list('key', 'digest'))
+        return found
+
+    def fresh(self, keyed_messages: list) -> list:
+        """
+        Filters out duplicates from list of (key, digest, body, message) tuples, keeping the order of messages.
+        """
+        current = self.stored(list({key for key, *_ in keyed_messages}))
+        fresh = []
+        for key, digest, body, message in keyed_messages:
+            if current.get(key, None) != digest:
+                current[key] = digest
+                fresh.append((key, digest, body, message))
+        return fresh
+
+    def persist(self, keyed_messages: list) -> None:
+        processed = {key: ProcessedMessage(key=key, digest=digest) for key, digest, *_ in keyed_messages}
+        ProcessedMessage.objects.bulk_create(processed.values(), update_conflicts=True, unique_fields=['key'],
+                                             update_fields=['digest', 'processed_at'])
+
+    def remember(self, keyed_messages: list) -> None:
+        for key, digest, *_ in keyed_messages:
+            self.recent[key] = digest
+            self.recent.move_to_end(key)
+        while len(self.recent) > self.size:
+            self.recent.popitem(last=False)
+
+
+class MessageBatch:
+    """
+    Collects messages consumed from the rides queue and processes them in batches of given size.
+    Messages already processed within the deduplication window are skipped.
+    Whole batch is acknowledged with a single ack. If the batch fails, its messages are processed one by one,
+    so a single broken message does not block the others.
+    """
+
+    def __init__(self, size: int, deduplicator: MessageDeduplicator or None = None):
+        self.size = size
+        self.messages = []
+        self.deduplicator = deduplicator or MessageDeduplicator(size=settings.RIDES_DEDUP_MEMORY_SIZE)
+
+    def add(self, body: dict, message) -> None:
+        self.messages.append((body, message))
+        if len(self.messages) >= self.size:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self.messages:
+            return
+        messages, self.messages = self.messages, []
+
+        keyed_messages = [(*message_key(body, message), body, message) for body, message in messages]
+        fresh = self.deduplicator.fresh(keyed_messages)
+
+        try:
+            with transaction.atomic():
+                process_batch([body for _, _, body, _ in fresh])
+                self.deduplicator.persist(fresh)
+        except Exception:
+            logger.exception('Processing batch of %d messages failed, processing them one by one', len(fresh))
+            self._process_one_by_one(fresh)
+            fresh_messages = {id(message) for *_, message in fresh}
+            for _, message in messages:
+                if id(message) not in fresh_messages:
+                    message.ack()
+        else:
+            self.deduplicator.remember(fresh)
+            messages[-1][1].ack(multiple=True)
+        logger.debug('Processed batch of %d messages, %d duplicates skipped', len(fresh),
+                     len(messages) - len(fresh))
+
+    def _process_one_by_one(self, keyed_messages: list) -> None:
+        for keyed_message in keyed_messages:
+            _, _, body, message = keyed_message
+            try:
+                with transaction.atomic():
+                    process_message(body)
+                    self.deduplicator.persist([keyed_message])
+            except Exception:
+                logger.exception('Processing message %s failed', body.get('title'))
+                if message.delivery_info.get('redelivered'):
+                    message.reject(requeue=False)
+                else:
+                    message.requeue()
+            else:
+                self.deduplicator.remember([keyed_message])
+                message.ack()
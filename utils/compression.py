@@ -0,0 +1,168 @@
+import zlib
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 4
+ZSTD_LEVEL = 3
+
+
+class _Gzip:
+    def __init__(self):
+        self.compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes) -> bytes:
+        return self.compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self.compressor.flush(zlib.Z_FINISH)
+
+
+class _Brotli:
+    def __init__(self):
+        self.compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def compress(self, data: bytes) -> bytes:
+        return self.compressor.process(data)
+
+    def flush(self) -> bytes:
+        return self.compressor.flush()
+
+    def finish(self) -> bytes:
+        return self.compressor.finish()
+
+
+class _Zstd:
+    def __init__(self):
+        self.compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self.compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self.compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self) -> bytes:
+        return self.compressor.flush(zstandard.COMPRESSOBJ_FLUSH_FINISH)
+
+
+# content codings with their compressors, codings of libraries that are not installed are not offered
+CODECS = {'gzip': _Gzip}
+if brotli is not None:
+    CODECS['br'] = _Brotli
+if zstandard is not None:
+    CODECS['zstd'] = _Zstd
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    compressor = CODECS[encoding]()
+    return compressor.compress(data) + compressor.finish()
+
+
+def compress_stream(chunks, encoding: str):
+    """
+    Compresses iterable of byte chunks, every chunk is flushed, so the client receives data as soon as it is produced.
+    """
+    compressor = CODECS[encoding]()
+    for chunk in chunks:
+        data = compressor.compress(chunk) + compressor.flush()
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+def accepted_encodings(accept_encoding: str) -> dict:
+    """
+    Parses Accept-Encoding header into dictionary of codings and their quality values,
+    ex. 'gzip, br;q=0.8' -> {'gzip': 1.0, 'br': 0.8}.
+    """
+    encodings = {}
+    for item in accept_encoding.split(','):
+        coding, *params = [part.strip() for part in item.split(';')]
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        encodings[coding.lower()] = quality
+    return encodings
+
+
+def select_encoding(accept_encoding: str, preferred: list) -> str or None:
+    """
+    Selects content coding for the response: the one with the highest quality value accepted by the client,
+    codings with the same quality are chosen in the server preference order.
+
+    :param accept_encoding: Accept-Encoding header of the request
+    :param preferred: available codings in the server preference order
+    :return: selected coding or None if the response should not be compressed
+    """
+    accepted = accepted_encodings(accept_encoding)
+    best, best_quality = None, 0.0
+    for encoding in preferred:
+        quality = accepted.get(encoding, accepted.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+class CompressionMiddleware:
+    """
+    Compresses responses with gzip, brotli (br) or zstd, depending on Accept-Encoding header of the request
+    and RESPONSE_COMPRESSION_ENCODINGS preference. Responses smaller than RESPONSE_COMPRESSION_MIN_BYTES are sent
+    as they are. Streaming responses are compressed chunk by chunk, so they are still streamed.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.encodings = [encoding for encoding in settings.RESPONSE_COMPRESSION_ENCODINGS if encoding in CODECS]
+
+    def __call__(self, request):
+        return self.process_response(request, self.get_response(request))
+
+    def process_response(self, request, response):
+        if not self.encodings or response.has_header('Content-Encoding'):
+            return response
+        if not response.streaming and len(response.content) < settings.RESPONSE_COMPRESSION_MIN_BYTES:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = select_encoding(request.headers.get('Accept-Encoding', ''), self.encodings)
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            response.streaming_content = compress_stream(response.streaming_content, encoding)
+            del response['Content-Length']
+        else:
+            compressed = compress(response.content, encoding)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response['Content-Length'] = str(len(compressed))
+
+        # compressed body differs from the identity one, so strong ETag is weakened (as in GZipMiddleware)
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = encoding
+        return response
@@ -0,0 +1,52 @@
+import hashlib
+
+from django.db.models import Count, Sum, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+
+def queryset_state(queryset, prefix: str = '') -> dict:
+    """
+    Returns state of rides in queryset with a single aggregate query: number of rows, sum of ride versions
+    and the last ride update. Every change of a ride increments its version, so the state changes whenever
+    any ride in the queryset changes, or a ride is added to or removed from it.
+
+    :param queryset: queryset with rides or objects related to rides
+    :param prefix: lookup path to ride (ex. 'ride__' for participations)
+    """
+    return queryset.order_by().aggregate(count=Count('pk'), versions=Sum(f'{prefix}version'),
+                                         updated_at=Max(f'{prefix}updated_at'))
+
+
+def conditional_get(request, queryset, render, prefix: str = '', etag_parts: tuple = (), last_modified: bool = False):
+    """
+    Handles conditional GET of data computed from queryset. ETag is computed from queryset state (see queryset_state),
+    request path with query parameters and etag_parts. If the client already has the current version (If-None-Match
+    or If-Modified-Since headers), 304 response is returned without calling render.
+    Last-Modified is used only for single objects (last_modified=True), the last update of rows left in a list
+    does not change when a ride is removed from it, so lists are validated by ETag only.
+
+    :param request: request
+    :param queryset: queryset the response is built from
+    :param render: function returning the response
+    :param prefix: lookup path to ride in queryset
+    :param etag_parts: other values the response depends on (ex. user id)
+    :param last_modified: whether Last-Modified header is set and If-Modified-Since is checked
+    :return: 304 response or response returned by render with ETag (and Last-Modified) headers
+    """
+    state = queryset_state(queryset, prefix)
+    parts = (request.get_full_path(), request.headers.get('Accept', ''), state['count'], state['versions'],
+             state['updated_at'], *etag_parts)
+    etag = '"%s"' % hashlib.sha1(repr(parts).encode()).hexdigest()
+    modified_at = int(state['updated_at'].timestamp()) if last_modified and state['updated_at'] else None
+
+    response = get_conditional_response(request, etag=etag, last_modified=modified_at)
+    if response is not None:
+        return response
+
+    response = render()
+    if response.status_code == 200:
+        response['ETag'] = etag
+        if modified_at is not None:
+            response['Last-Modified'] = http_date(modified_at)
+    return response
@@ -0,0 +1,172 @@
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from rest_framework import serializers
+
+FIELDS_PARAM = 'fields'
+EXPAND_PARAM = 'expand'
+
+
+def _requested(request, param: str) -> list or None:
+    if request is None or param not in request.query_params:
+        return None
+    return [name.strip() for name in request.query_params[param].split(',') if name.strip()]
+
+
+def _split(paths: list) -> dict:
+    """
+    Converts list of dotted paths into dictionary of top level names and lists of their nested paths,
+    ex. ['ride_id', 'driver.email'] -> {'ride_id': [], 'driver': ['email']}.
+    """
+    tree = {}
+    for path in paths:
+        name, _, nested = path.partition('.')
+        tree.setdefault(name, [])
+        if nested:
+            tree[name].append(nested)
+    return tree
+
+
+def _collapsed(field):
+    """
+    Returns field rendering related object (or objects) as primary key instead of nested object.
+    Source of bound field (nested serializer fields) defaults to its name and DRF rejects such redundant source,
+    so it is passed only when it differs from the name.
+    """
+    kwargs = {'read_only': True}
+    if field.source not in (None, field.field_name):
+        kwargs['source'] = field.source
+    if isinstance(field, serializers.ListSerializer):
+        # the same list serializer class is used, so filtering done by it still applies
+        return type(field)(child=serializers.PrimaryKeyRelatedField(read_only=True), **kwargs)
+    return serializers.PrimaryKeyRelatedField(**kwargs)
+
+
+def prune_fields(fields: dict, requested_fields: list or None, expand: list or None) -> dict:
+    """
+    Removes fields that were not requested and replaces nested serializers that are not expanded with primary keys.
+    Nested fields can be selected with dotted paths (ex. driver.email), all fields of nested serializer are kept
+    when only its name is given.
+
+    :param fields: serializer fields
+    :param requested_fields: requested field paths or None for all fields
+    :param expand: names of expanded relations or None to expand all of them
+    :return: pruned fields
+    """
+    nested_fields = {}
+    if requested_fields is not None:
+        nested_fields = _split(requested_fields)
+        for name in list(fields):
+            if name not in nested_fields:
+                fields.pop(name)
+
+    expand_tree = _split(expand) if expand is not None else None
+    for name, field in list(fields.items()):
+        nested = field.child if isinstance(field, serializers.ListSerializer) else field
+        if not isinstance(nested, serializers.BaseSerializer):
+            continue
+        if expand_tree is not None and name not in expand_tree:
+            fields[name] = _collapsed(field)
+            continue
+        nested_expand = expand_tree[name] or None if expand_tree is not None else None
+        prune_fields(nested.fields, nested_fields.get(name) or None, nested_expand)
+    return fields
+
+
+class SparseFieldsMixin:
+    """
+    Serializer mixin pruning its fields with 'fields' and 'expand' query parameters of the request from context,
+    ex. ?fields=ride_id,city_from,start_date,price&expand=city_from. Without the parameters all fields are returned.
+    """
+
+    def _is_top_level(self) -> bool:
+        return self.parent is None or (isinstance(self.parent, serializers.ListSerializer) and self.parent.parent is None)
+
+    def get_fields(self):
+        fields = super().get_fields()
+        if not self._is_top_level():
+            return fields
+        request = self.context.get('request')
+        requested_fields, expand = _requested(request, FIELDS_PARAM), _requested(request, EXPAND_PARAM)
+        if requested_fields is None and expand is None:
+            return fields
+        return prune_fields(fields, requested_fields, expand)
+
+
+def _concrete_field(model, name: str):
+    try:
+        field = model._meta.get_field(name)
+    except FieldDoesNotExist:
+        return None
+    return field if field.concrete else None
+
+
+def _relation(model, accessor: str):
+    """
+    Returns model relation with given attribute name, reverse relations are found by their accessor (ex. ride_set).
+    """
+    for field in model._meta.get_fields():
+        if field.is_relation and (field.name == accessor or (field.auto_created and not field.concrete and
+                                                             field.get_accessor_name() == accessor)):
+            return field
+    raise FieldDoesNotExist(f'{model.__name__} has no relation {accessor}')
+
+
+def sparse_queryset(queryset, serializer, required: tuple = ()):
+    """
+    Limits queryset to what the serializer renders: nested objects are loaded with select_related
+    or prefetch_related, columns of not rendered fields are deferred and relations that are not rendered
+    are not queried at all.
+
+    :param queryset: queryset with serialised objects
+    :param serializer: serializer (or its child for lists) with pruned fields
+    :param required: names of fields that have to be loaded even if they are not rendered
+    :return: optimised queryset
+
+    List serializers can list fields they need for filtering in 'required_fields' attribute.
+    """
+    model = queryset.model
+    select, prefetch, only = [], [], {model._meta.pk.name, *required}
+    defer_columns = True
+    for name, field in serializer.fields.items():
+        source = field.source
+        if isinstance(field, serializers.ListSerializer):
+            relation = _relation(model, source)
+            # reverse foreign key has to be loaded to match prefetched objects with their parents
+            child_required = (relation.field.name,) if relation.one_to_many else ()
+            child_required += getattr(field, 'required_fields', ())
+            child_queryset = relation.related_model.objects.all()
+            if isinstance(field.child, serializers.BaseSerializer):
+                child_queryset = sparse_queryset(child_queryset, field.child, child_required)
+            else:
+                child_queryset = child_queryset.only(relation.related_model._meta.pk.name, *child_required)
+            prefetch.append(Prefetch(source, queryset=child_queryset))
+        elif isinstance(field, serializers.ManyRelatedField):
+            prefetch.append(source)
+        elif isinstance(field, serializers.BaseSerializer):
+            select.append(source)
+            only.add(source)
+        elif _concrete_field(model, source if source != '*' else name) is not None:
+            only.add(source if source != '*' else name)
+        else:
+            # value computed from other attributes (ex. property), all columns are needed
+            defer_columns = False
+
+    queryset = queryset.select_related(*select).prefetch_related(*prefetch)
+    if defer_columns:
+        queryset = queryset.only(*only)
+    return queryset
+
+
+class SparseFieldsViewMixin:
+    """
+    Viewset mixin optimising queryset of GET requests with 'fields' or 'expand' query parameters,
+    so only data of the requested fields is queried. Serializers have to use SparseFieldsMixin.
+    """
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        request = self.request
+        if request.method != 'GET' or (FIELDS_PARAM not in request.query_params and
+                                       EXPAND_PARAM not in request.query_params):
+            return queryset
+        return sparse_queryset(queryset, self.get_serializer())
@@ -1,7 +1,8 @@
 from django.db.models import QuerySet
-from django.http import JsonResponse
 from rest_framework import status
 
+from utils.renderers import JsonResponse
+
 
 def get_paginated_queryset(self, queryset: QuerySet) -> JsonResponse:
     page = self.paginate_queryset(queryset)
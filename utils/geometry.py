@@ -0,0 +1,53 @@
+import math
+
+EARTH_RADIUS_M = 6371008.8
+
+
+def _project(points: list) -> list:
+    """
+    Projects (lat, lng) points to plane coordinates in metres (equirectangular projection around the mean latitude),
+    which is precise enough for distances within a single route.
+    """
+    mean_lat = math.radians(sum(float(lat) for lat, _ in points) / len(points))
+    scale_x = EARTH_RADIUS_M * math.cos(mean_lat)
+    return [(math.radians(float(lng)) * scale_x, math.radians(float(lat)) * EARTH_RADIUS_M) for lat, lng in points]
+
+
+def _segment_distance(point: tuple, start: tuple, end: tuple) -> float:
+    (x, y), (x1, y1), (x2, y2) = point, start, end
+    dx, dy = x2 - x1, y2 - y1
+    length = dx * dx + dy * dy
+    if length == 0:
+        return math.hypot(x - x1, y - y1)
+    t = max(0.0, min(1.0, ((x - x1) * dx + (y - y1) * dy) / length))
+    return math.hypot(x - x1 - t * dx, y - y1 - t * dy)
+
+
+def simplify(points: list, tolerance: float) -> list:
+    """
+    Simplifies route with Douglas-Peucker algorithm: removes points that are closer than tolerance to the line
+    through the points kept around them. The first and the last point are always kept.
+
+    :param points: list of (lat, lng) pairs
+    :param tolerance: maximal distance in metres between the original and the simplified route, 0 disables it
+    :return: list of kept points
+    """
+    if tolerance <= 0 or len(points) < 3:
+        return list(points)
+
+    projected = _project(points)
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        max_distance, farthest = 0.0, None
+        for index in range(first + 1, last):
+            point_distance = _segment_distance(projected[index], projected[first], projected[last])
+            if point_distance > max_distance:
+                max_distance, farthest = point_distance, index
+        if farthest is not None and max_distance > tolerance:
+            keep[farthest] = True
+            stack.append((first, farthest))
+            stack.append((farthest, last))
+    return [point for point, kept in zip(points, keep) if kept]
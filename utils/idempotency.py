@@ -0,0 +1,95 @@
+import datetime
+import functools
+import hashlib
+import json
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.http import HttpResponse
+from django.utils import timezone
+from rest_framework import status
+
+from users.models import IdempotentResponse
+from utils.metrics import increment
+from utils.renderers import JsonResponse
+
+HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = 255
+
+
+def response_key(request, idempotency_key: str) -> str:
+    return hashlib.sha256(f'{request.user.pk}:{request.method}:{request.path}:{idempotency_key}'.encode()).hexdigest()
+
+
+def request_digest(request) -> str:
+    return hashlib.sha1(json.dumps(request.data, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _replay(stored: IdempotentResponse, digest: str) -> HttpResponse:
+    if stored.status == 0:
+        return JsonResponse(status=status.HTTP_409_CONFLICT, data=f"Request with this {HEADER} is being processed",
+                            safe=False)
+    if stored.request_digest != digest:
+        return JsonResponse(status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            data=f"{HEADER} was already used for a different request", safe=False)
+    increment('idempotency.replay')
+    response = HttpResponse(bytes(stored.body), status=stored.status, content_type=stored.content_type)
+    response[REPLAYED_HEADER] = 'true'
+    return response
+
+
+def idempotent(view_method):
+    """
+    Decorator of viewset actions creating objects. Response to the first request with Idempotency-Key header
+    is stored for IDEMPOTENCY_KEY_TTL seconds and retries of the request get the stored response (found by primary
+    key) without running the action again. Key used for a different request body is rejected with 422, retry
+    sent while the first request is still processed gets 409. Request not completed within
+    IDEMPOTENCY_PROCESSING_TIMEOUT seconds (ex. its worker was killed) is taken as failed and its retry is run again.
+    Server errors are not stored, so such requests can be retried. Requests without the header are not affected.
+    """
+
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        idempotency_key = request.headers.get(HEADER)
+        if not idempotency_key:
+            return view_method(self, request, *args, **kwargs)
+        if len(idempotency_key) > MAX_KEY_LENGTH:
+            return JsonResponse(status=status.HTTP_400_BAD_REQUEST, data=f"Invalid {HEADER} header", safe=False)
+
+        key, digest = response_key(request, idempotency_key), request_digest(request)
+        claimed_at = timezone.now()
+        window_start = claimed_at - datetime.timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+        processing_start = claimed_at - datetime.timedelta(seconds=settings.IDEMPOTENCY_PROCESSING_TIMEOUT)
+        stored = IdempotentResponse.objects.filter(key=key, created_at__gte=window_start).first()
+        if stored is not None and (stored.status != 0 or stored.created_at >= processing_start):
+            return _replay(stored, digest)
+
+        try:
+            with transaction.atomic():
+                # expired response and abandoned claim with the same key are replaced
+                IdempotentResponse.objects.filter(Q(created_at__lt=window_start) |
+                                                  Q(status=0, created_at__lt=processing_start), key=key).delete()
+                IdempotentResponse.objects.create(key=key, request_digest=digest, created_at=claimed_at)
+        except IntegrityError:
+            # concurrent request with the same key was first
+            return _replay(IdempotentResponse(status=0), digest)
+
+        # request taken as abandoned must not overwrite claim of its retry
+        claim = IdempotentResponse.objects.filter(key=key, created_at=claimed_at)
+        try:
+            response = view_method(self, request, *args, **kwargs)
+        except Exception:
+            claim.delete()
+            raise
+
+        # only rendered responses (JsonResponse) can be stored
+        if response.status_code >= 500 or response.streaming or not getattr(response, 'is_rendered', True):
+            claim.delete()
+        else:
+            claim.update(status=response.status_code, body=response.content,
+                         content_type=response.get('Content-Type', ''))
+        return response
+
+    return wrapper
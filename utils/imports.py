@@ -0,0 +1,149 @@
+import csv
+import datetime
+import itertools
+import json
+import os
+import uuid
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from rides.models import Ride, TimetableImport
+from utils.services import build_bulk_rides, publish_created_rides, RIDE_KEYS
+
+CITY_FIELDS = ('name', 'county', 'state', 'lat', 'lng')
+FORMAT_EXTENSIONS = {'.csv': TimetableImport.Format.CSV, '.jsonl': TimetableImport.Format.JSONL,
+                     '.ndjson': TimetableImport.Format.JSONL}
+
+
+def file_format(file_name: str) -> str or None:
+    return FORMAT_EXTENSIONS.get(os.path.splitext(file_name)[1].lower())
+
+
+def save_upload(uploaded_file, import_format: str) -> str:
+    """
+    Saves uploaded timetable file chunk by chunk in RIDES_IMPORT_DIR and returns its path.
+    """
+    os.makedirs(settings.RIDES_IMPORT_DIR, exist_ok=True)
+    path = os.path.join(settings.RIDES_IMPORT_DIR, f'{uuid.uuid4().hex}.{import_format}')
+    with open(path, 'wb') as file:
+        for chunk in uploaded_file.chunks():
+            file.write(chunk)
+    return path
+
+
+def csv_ride(row: dict) -> dict or None:
+    """
+    Converts CSV row into ride data in the API format. Cities are given in city_from_<field> and city_to_<field>
+    columns (name, county, state, lat, lng), duration in duration_hours and duration_minutes columns and coordinates
+    as JSON list. Other columns have the same names as ride fields, empty values are skipped.
+
+    :param row: CSV row
+    :return: ride data or None if the row cannot be converted
+    """
+    ride = {key: value for key, value in row.items() if key in RIDE_KEYS and value not in ('', None)}
+    for city in ('city_from', 'city_to'):
+        ride[city] = {field: row.get(f'{city}_{field}') for field in CITY_FIELDS}
+    try:
+        ride['duration'] = {'hours': int(row.get('duration_hours') or 0),
+                            'minutes': int(row.get('duration_minutes') or 0)}
+        ride['coordinates'] = json.loads(row.get('coordinates') or '[]')
+    except ValueError:
+        return None
+    return ride
+
+
+def _json_ride(line: str) -> dict or None:
+    try:
+        return json.loads(line)
+    except ValueError:
+        return None
+
+
+def read_rides(file, import_format: str):
+    """
+    Reads rides from timetable file one by one, without loading the whole file. Rows which cannot be parsed
+    are returned as None, so they are reported as invalid and row numbers do not change.
+
+    :param file: opened text file
+    :param import_format: csv or jsonl
+    :return: generator of ride data
+    """
+    if import_format == TimetableImport.Format.CSV:
+        return (csv_ride(row) for row in csv.DictReader(file))
+    return (_json_ride(line) for line in file if line.strip())
+
+
+def _import_batch(timetable_import: TimetableImport, batch: list) -> None:
+    rides, errors = build_bulk_rides(batch, RIDE_KEYS, timetable_import.user,
+                                     first_index=timetable_import.processed_rows)
+    with transaction.atomic():
+        Ride.objects.bulk_create(rides)
+        timetable_import.processed_rows += len(batch)
+        timetable_import.created_rides += len(rides)
+        timetable_import.failed_rows += len(errors)
+        timetable_import.errors = (timetable_import.errors + errors)[:settings.RIDES_IMPORT_MAX_ERRORS]
+        timetable_import.save(update_fields=['processed_rows', 'created_rides', 'failed_rows', 'errors', 'updated_at'])
+
+    if rides:
+        publish_created_rides([ride.ride_id for ride in rides])
+
+
+def stale_before() -> datetime.datetime:
+    return timezone.now() - datetime.timedelta(seconds=settings.RIDES_IMPORT_STALE_TIMEOUT)
+
+
+def is_resumable(timetable_import: TimetableImport) -> bool:
+    """
+    Returns whether import can be resumed: it failed, or it is running but was not updated for
+    RIDES_IMPORT_STALE_TIMEOUT seconds, so its worker was killed.
+    """
+    return timetable_import.status == TimetableImport.Status.FAILED or \
+        (timetable_import.status == TimetableImport.Status.RUNNING and timetable_import.updated_at < stale_before())
+
+
+def claim_import(import_id: int, statuses: tuple = (TimetableImport.Status.PENDING, TimetableImport.Status.FAILED)) \
+        -> TimetableImport or None:
+    """
+    Marks import as running if it has one of given statuses or it is a stale running import (see is_resumable),
+    so the same import is never run twice at once.
+
+    :return: claimed import or None if it is already running or completed
+    """
+    stale = Q(status=TimetableImport.Status.RUNNING, updated_at__lt=stale_before())
+    claimed = TimetableImport.objects.filter(Q(status__in=statuses) | stale, pk=import_id) \
+        .update(status=TimetableImport.Status.RUNNING, updated_at=timezone.now())
+    return TimetableImport.objects.select_related('user').get(pk=import_id) if claimed else None
+
+
+def run_import(timetable_import: TimetableImport, batch_size: int or None = None) -> TimetableImport:
+    """
+    Imports rides from timetable file in batches of batch_size rows (RIDES_IMPORT_BATCH_SIZE by default).
+    Rows imported before (processed_rows) are skipped, so failed import continues after the last imported batch.
+    Only a single batch is held in memory. Uploaded file is deleted when the import is completed.
+
+    :param timetable_import: claimed import (see claim_import)
+    :param batch_size: number of rows inserted at once
+    :return: finished import
+    """
+    batch_size = batch_size or settings.RIDES_IMPORT_BATCH_SIZE
+    try:
+        with open(timetable_import.path, newline='', encoding='utf-8') as file:
+            rides = itertools.islice(read_rides(file, timetable_import.format), timetable_import.processed_rows, None)
+            for batch in iter(lambda: list(itertools.islice(rides, batch_size)), []):
+                _import_batch(timetable_import, batch)
+    except Exception:
+        timetable_import.status = TimetableImport.Status.FAILED
+        timetable_import.save(update_fields=['status', 'updated_at'])
+        raise
+
+    timetable_import.status = TimetableImport.Status.COMPLETED
+    timetable_import.save(update_fields=['status', 'updated_at'])
+    if timetable_import.uploaded:
+        try:
+            os.remove(timetable_import.path)
+        except FileNotFoundError:
+            pass
+    return timetable_import
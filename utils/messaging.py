@@ -0,0 +1,147 @@
+from collections import namedtuple
+
+from django.conf import settings
+from kombu import serialization, compression
+
+EXCHANGE_NAME = 'trawell_exchange'
+
+COMPACT_FORMAT = 'rides.compact'
+COMPACT_FORMAT_VERSION = 1
+COMPACT_ROW_FIELDS = ['ride_id', 'start_date']
+
+COMPRESSION_MIN_SIZE = 1024
+
+EncodedBody = namedtuple('EncodedBody', ['content_type', 'content_encoding', 'payload', 'headers'])
+
+
+def build_body(message, title: str, chunk: dict or None = None) -> dict:
+    body = {
+        'title': title,
+        'message': message
+    }
+    if chunk is not None:
+        body['chunk'] = chunk
+    return body
+
+
+def encode_body(body: dict, serializer: str = 'json', compression_method: str or None = None) -> EncodedBody:
+    """
+    Serialises message body once, so the same payload can be published to many queues.
+    Payloads bigger than COMPRESSION_MIN_SIZE are compressed if compression method is given, the method is passed
+    to consumers in 'compression' header, the same way kombu does it.
+
+    :param body: message body
+    :param serializer: name of kombu serializer (ex. json, msgpack)
+    :param compression_method: name of kombu compression method (ex. zlib) or None
+    :return: content type, content encoding, encoded payload and message headers
+    """
+    content_type, content_encoding, payload = serialization.dumps(body, serializer=serializer)
+    headers = {}
+    if compression_method and len(payload) >= COMPRESSION_MIN_SIZE:
+        payload, headers['compression'] = compression.compress(payload, compression_method)
+    return EncodedBody(content_type, content_encoding, payload, headers)
+
+
+def encode_event(message, title: str, chunk: dict or None = None) -> EncodedBody:
+    return encode_body(build_body(message, title, chunk), serializer=settings.EVENTS_SERIALIZER,
+                       compression_method=settings.EVENTS_COMPRESSION)
+
+
+def publish_encoded(producer, encoded: EncodedBody, routing_keys: list, exchange: str = EXCHANGE_NAME,
+                    declare: list = ()):
+    """
+    Publishes already encoded payload with given producer to every routing key.
+    Entities from declare list are declared before publishing, kombu caches declarations per connection
+    and clears the cache when connection is lost, so they are declared once and again after reconnect.
+
+    :param producer: acquired kombu producer
+    :param encoded: result of encode_body
+    :param routing_keys: routing keys the payload is delivered to
+    :param exchange: exchange name
+    :param declare: exchanges and queues that have to exist before publishing
+    """
+    for routing_key in routing_keys:
+        producer.publish(
+            encoded.payload,
+            exchange=exchange,
+            routing_key=routing_key,
+            content_type=encoded.content_type,
+            content_encoding=encoded.content_encoding,
+            headers=encoded.headers,
+            declare=list(declare),
+            retry=True,
+        )
+
+
+def list_chunks(items: list, chunk_size: int):
+    """
+    Splits already serialised list into chunks with at most chunk_size elements.
+    """
+    for start in range(0, len(items), chunk_size):
+        yield items[start:start + chunk_size]
+
+
+def queryset_chunks(queryset, serializer_class, chunk_size: int):
+    """
+    Iterates over queryset in database chunks and serialises it chunk by chunk,
+    so only chunk_size objects are held in memory at once.
+
+    :param queryset: queryset with objects to serialise
+    :param serializer_class: serializer used for each chunk
+    :param chunk_size: number of objects in a chunk
+    :return: generator of serialised chunks
+    """
+    chunk = []
+    for instance in queryset.iterator(chunk_size=chunk_size):
+        chunk.append(instance)
+        if len(chunk) == chunk_size:
+            yield serializer_class(instance=chunk, many=True).data
+            chunk = []
+    if chunk:
+        yield serializer_class(instance=chunk, many=True).data
+
+
+def compact_rides(rides: list) -> dict:
+    """
+    Converts list of serialised rides into compact event format. Values shared by all rides are sent once
+    in the template, values that differ between rides are sent as rows, ordered as in 'fields' list.
+    Ride can be restored with {**template, **dict(zip(fields, row))}.
+
+    :param rides: list of serialised rides
+    :return: compact event message
+    """
+    template = dict(rides[0]) if rides else {}
+    fields = COMPACT_ROW_FIELDS + [key for key in template if key not in COMPACT_ROW_FIELDS and any(
+        ride[key] != template[key] for ride in rides[1:])]
+    for field in fields:
+        template.pop(field, None)
+
+    return {
+        'format': COMPACT_FORMAT,
+        'version': COMPACT_FORMAT_VERSION,
+        'template': template,
+        'fields': fields,
+        'rows': [[ride.get(field) for field in fields] for ride in rides],
+    }
+
+
+def expand_rides(message: dict) -> list:
+    """
+    Restores list of rides from compact event message.
+
+    :param message: message created by compact_rides
+    :return: list of serialised rides
+    """
+    template, fields = message['template'], message['fields']
+    return [{**template, **dict(zip(fields, row))} for row in message['rows']]
+
+
+def bulk_rides_message(rides: list) -> list or dict:
+    """
+    Returns message content for events with many rides, compact format is used if enabled in settings.
+
+    :param rides: list of serialised rides
+    """
+    if settings.EVENTS_COMPACT_BULK:
+        return compact_rides(rides)
+    return rides
@@ -0,0 +1,60 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+logger = logging.getLogger('rides.metrics')
+
+_lock = threading.Lock()
+_counters = defaultdict(int)
+_timings = defaultdict(lambda: {'count': 0, 'wall': 0.0, 'cpu': 0.0})
+
+
+def increment(name: str, value: int = 1) -> None:
+    """
+    Increments process-wide counter with given name.
+
+    :param name: counter name
+    :param value: value added to the counter
+    """
+    with _lock:
+        _counters[name] += value
+
+
+@contextmanager
+def timed(name: str, **labels):
+    """
+    Measures wall clock and CPU time of the wrapped block and records it under given name.
+    Yielded dictionary can be filled with additional values (ex. payload size) that are logged with timings.
+
+    :param name: timing name
+    :param labels: additional values logged with measured times
+    """
+    extra = dict(labels)
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    try:
+        yield extra
+    finally:
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+        with _lock:
+            timing = _timings[name]
+            timing['count'] += 1
+            timing['wall'] += wall
+            timing['cpu'] += cpu
+        logger.debug('%s wall=%.3fms cpu=%.3fms %s', name, wall * 1000, cpu * 1000, extra)
+
+
+def snapshot() -> dict:
+    """
+    Returns copy of all counters and timings recorded in this process.
+    """
+    with _lock:
+        return {'counters': dict(_counters), 'timings': {name: dict(value) for name, value in _timings.items()}}
+
+
+def reset() -> None:
+    with _lock:
+        _counters.clear()
+        _timings.clear()
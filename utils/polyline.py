@@ -0,0 +1,58 @@
+from decimal import Decimal, ROUND_HALF_UP
+
+PRECISION = 6
+
+
+def _encode_value(value: int) -> str:
+    value = ~(value << 1) if value < 0 else value << 1
+    chunks = []
+    while value >= 0x20:
+        chunks.append(chr((0x20 | (value & 0x1f)) + 63))
+        value >>= 5
+    chunks.append(chr(value + 63))
+    return ''.join(chunks)
+
+
+def _scaled(value, precision: int) -> int:
+    return int((Decimal(str(value)) * 10 ** precision).to_integral_value(rounding=ROUND_HALF_UP))
+
+
+def encode(points, precision: int = PRECISION) -> str:
+    """
+    Encodes route points with encoded polyline algorithm (the format used by Google Maps and OSRM):
+    differences of consecutive coordinates rounded to given number of decimal places, written as base64-like
+    characters. 500 points of a typical route take a few kilobytes instead of 500 rows.
+
+    :param points: iterable of (lat, lng) pairs (Decimal, float or str)
+    :param precision: number of decimal places kept
+    :return: encoded polyline
+    """
+    encoded, previous_lat, previous_lng = [], 0, 0
+    for lat, lng in points:
+        lat, lng = _scaled(lat, precision), _scaled(lng, precision)
+        encoded.append(_encode_value(lat - previous_lat))
+        encoded.append(_encode_value(lng - previous_lng))
+        previous_lat, previous_lng = lat, lng
+    return ''.join(encoded)
+
+
+def decode(polyline: str, precision: int = PRECISION):
+    """
+    Decodes encoded polyline (see encode) into (lat, lng) pairs of Decimals, points are generated one by one.
+    """
+    index, lat, lng = 0, 0, 0
+    values = []
+    while index < len(polyline):
+        result, shift = 0, 0
+        while True:
+            byte = ord(polyline[index]) - 63
+            index += 1
+            result |= (byte & 0x1f) << shift
+            shift += 5
+            if byte < 0x20:
+                break
+        values.append(~(result >> 1) if result & 1 else result >> 1)
+        if len(values) == 2:
+            lat, lng = lat + values[0], lng + values[1]
+            values = []
+            yield Decimal(lat).scaleb(-precision), Decimal(lng).scaleb(-precision)
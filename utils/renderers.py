@@ -0,0 +1,51 @@
+import json
+
+import orjson
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+from rest_framework.renderers import JSONRenderer
+
+OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+
+def dumps(data, encoder_class=DjangoJSONEncoder) -> bytes:
+    """
+    Encodes data to JSON with orjson. Values orjson does not handle the same way as the stdlib encoder
+    (Decimal, datetime, date, time, timedelta, lazy strings) are passed to encoder_class, so their output
+    does not depend on the used encoder.
+
+    :param data: data to encode
+    :param encoder_class: json.JSONEncoder subclass used for not natively supported values
+    :return: encoded data
+    """
+    return orjson.dumps(data, default=encoder_class().default, option=OPTIONS)
+
+
+class JsonResponse(HttpResponse):
+    """
+    Drop-in replacement of django.http.JsonResponse, encoding data with orjson (see dumps).
+    """
+
+    def __init__(self, data, encoder=DjangoJSONEncoder, safe=True, json_dumps_params=None, **kwargs):
+        if safe and not isinstance(data, dict):
+            raise TypeError('In order to allow non-dict objects to be serialized set the safe parameter to False.')
+        kwargs.setdefault('content_type', 'application/json')
+        if json_dumps_params:
+            content = json.dumps(data, cls=encoder, **json_dumps_params)
+        else:
+            content = dumps(data, encoder)
+        super().__init__(content=content, **kwargs)
+
+
+class ORJSONRenderer(JSONRenderer):
+    """
+    DRF JSON renderer encoding data with orjson. Indented output (ex. requested with 'indent' media type
+    parameter) is rendered by the default renderer.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        return dumps(data, self.encoder_class)
@@ -1,3 +1,4 @@
+from cities.cache import city_cache
 from cities.models import City
 from users.models import User
 from utils.utils import find_near_cities
@@ -6,16 +7,12 @@ from vehicles.models import Vehicle
 
 def city_object(city: dict) -> City | None:
     """
-    Finds requested city in database and returns its object.
+    Finds requested city (cached, see CityCache) and returns its object.
 
     :param city: dictionary with city data
     :return: found City object or None
     """
-    try:
-        city_obj = City.objects.get(name=city['name'], state=city['state'], county=city['county'])
-        return city_obj
-    except City.DoesNotExist:
-        return None
+    return city_cache.find(name=city['name'], county=city['county'], state=city['state'])
 
 
 def rides_with_cities_nearby(queryset, city_to: City, city_from: dict):
@@ -1,18 +1,23 @@
 import datetime
 
+from django.conf import settings
 from rest_framework import status
 
 from recurrent_rides.models import RecurrentRide
 from recurrent_rides.serializers import RecurrentRideSerializer
 from rides.models import Ride
-from rides.serializers import RideSerializer
+from rides.serializers import RideSerializer, build_ride
 from users.models import User
+from utils.messaging import list_chunks
 from utils.selectors import user_vehicle
 from utils.utils import validate_values, filter_input_data, get_duration, verify_available_seats
 from vehicles.models import Vehicle
-from rides_microservice.celery import queue_notify, queue_reviews
 from rides_microservice import tasks
 
+NOTIFY_AND_REVIEWS = ['notify', 'review']
+RIDE_KEYS = ['city_from', 'city_to', 'area_from', 'area_to', 'start_date', 'price', 'seats', 'vehicle', 'duration',
+             'description', 'coordinates', 'automatic_confirm']
+
 
 def extract_values(data: dict, expected_keys: list, user: User) -> (dict, Vehicle, datetime.timedelta):
     cleared_data = filter_input_data(data, expected_keys=expected_keys)
@@ -45,15 +50,95 @@ def create_or_update_ride(data: dict, keys: list, user: User, serializer: RideSe
     if type(ride) is RecurrentRide:
         rides = Ride.objects.filter(recurrent_ride=ride).all()
         serializer = RideSerializer(instance=rides, many=True)
-        tasks.publish_message(serializer.data, 'rides.create.many', queue_notify, 'notify')
-        tasks.publish_message(serializer.data, 'rides.create.many', queue_reviews, 'review')
+        tasks.publish_chunks(list_chunks(serializer.data, settings.EVENTS_CHUNK_SIZE), 'rides.create.many',
+                             NOTIFY_AND_REVIEWS)
     else:
-        tasks.publish_message(serializer.data, 'rides.create', queue_notify, 'notify')
-        tasks.publish_message(serializer.data, 'rides.create', queue_reviews, 'review')
+        rides = Ride.objects.filter(ride_id=ride.ride_id)
+        tasks.publish_fanout(serializer.data, 'rides.create', NOTIFY_AND_REVIEWS)
+    tasks.schedule_archive(rides)
 
     return status.HTTP_200_OK, serializer.data
 
 
+def _validated_bulk_item(item, keys: list, user: User) -> (RideSerializer, str or dict or None):
+    if not isinstance(item, dict):
+        return None, 'Invalid ride data'
+    try:
+        cleared_data, vehicle, duration = extract_values(item, keys, user)
+    except TypeError:
+        return None, 'Duration parameter is invalid'
+    context = {'driver': user, 'vehicle': vehicle, 'duration': duration}
+    serializer = RideSerializer(data=cleared_data, context=context)
+    is_valid, message = validate_values(vehicle=vehicle, duration=duration, serializer=serializer, user=user,
+                                        partial=False)
+    return (serializer, None) if is_valid else (None, message)
+
+
+def build_bulk_rides(items: list, keys: list, user: User, first_index: int = 0) -> (list, list):
+    """
+    Validates data of many rides of company user with the same rules as create_or_update_ride and builds
+    not saved rides from the valid ones. Cities are resolved with the city cache, so every city is queried
+    at most once.
+
+    :param items: list with data of rides
+    :param keys: expected keys of ride data
+    :param user: company user creating the rides
+    :param first_index: index reported for the first item
+    :return: list of not saved rides and list of errors with indexes of invalid items
+    """
+    rides, errors = [], []
+    for index, item in enumerate(items, start=first_index):
+        serializer, message = _validated_bulk_item(item, keys, user)
+        if serializer is None:
+            errors.append({'index': index, 'errors': message})
+            continue
+        ride = build_ride(dict(serializer.validated_data), serializer.context)
+        # Ride.save is not called, so values it sets for a new ride are set here
+        ride.available_seats, ride.version = ride.seats, 1
+        rides.append(ride)
+    return rides, errors
+
+
+def publish_created_rides(ride_ids: list) -> list:
+    """
+    Publishes rides created in bulk as one rides.create.many event and schedules their archiving.
+
+    :param ride_ids: ids of created rides
+    :return: serialised rides
+    """
+    created = Ride.objects.filter(ride_id__in=ride_ids).order_by('ride_id') \
+        .select_related('city_from', 'city_to', 'driver', 'vehicle').prefetch_related('participation_set__user')
+    data = RideSerializer(instance=created, many=True).data
+    tasks.publish_chunks(list_chunks(data, settings.EVENTS_CHUNK_SIZE), 'rides.create.many', NOTIFY_AND_REVIEWS)
+    tasks.schedule_archive(created)
+    return data
+
+
+def create_rides_bulk(items: list, keys: list, user: User) -> (int, dict):
+    """
+    Creates many rides of company user at once. Every ride is validated separately (see build_bulk_rides),
+    invalid rides are reported with their index and the valid ones are inserted with a single bulk_create.
+
+    :param items: list with data of rides
+    :param keys: expected keys of ride data
+    :param user: company user creating the rides
+    :return: status code and dictionary with created rides and errors of invalid ones
+    """
+    if not isinstance(items, list) or not items:
+        return status.HTTP_400_BAD_REQUEST, "Expected non-empty list of rides"
+    if len(items) > settings.RIDES_BULK_MAX_ITEMS:
+        return status.HTTP_400_BAD_REQUEST, f"At most {settings.RIDES_BULK_MAX_ITEMS} rides can be created at once"
+
+    rides, errors = build_bulk_rides(items, keys, user)
+    if not rides:
+        return status.HTTP_400_BAD_REQUEST, {'created': [], 'errors': errors}
+
+    Ride.objects.bulk_create(rides, batch_size=settings.EVENTS_CHUNK_SIZE)
+    data = publish_created_rides([ride.ride_id for ride in rides])
+
+    return status.HTTP_200_OK, {'created': data, 'errors': errors}
+
+
 def update_partial_ride(instance, serializer, update_data, user):
     if user.private:
         expected_keys = ['seats', 'vehicle', 'description']
@@ -80,13 +165,12 @@ def cancel_ride(ride: Ride or RecurrentRide):
 
     if type(ride) is RecurrentRide:
         rides = Ride.objects.filter(recurrent_ride=ride).all()
-        serializer = RideSerializer(instance=rides, many=True)
 
-        tasks.publish_message(serializer.data, 'rides.cancel.many', queue_notify, 'notify')
-        tasks.publish_message(serializer.data, 'rides.cancel.many', queue_reviews, 'review')
+        tasks.publish_stream(rides, RideSerializer, 'rides.cancel.many', NOTIFY_AND_REVIEWS)
 
     else:
+        rides = Ride.objects.filter(ride_id=ride.ride_id)
         serializer = RideSerializer(ride)
-        tasks.publish_message(serializer.data, 'rides.cancel', queue_notify, 'notify')
-        tasks.publish_message(serializer.data, 'rides.cancel', queue_reviews, 'review')
+        tasks.publish_fanout(serializer.data, 'rides.cancel', NOTIFY_AND_REVIEWS)
+    tasks.schedule_archive(rides)
 
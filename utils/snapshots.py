@@ -0,0 +1,145 @@
+import datetime
+import fcntl
+import gzip
+import json
+import os
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+INDEX_FILE = 'index.jsonl'
+LOCK_FILE = '.lock'
+SEGMENT_SUFFIX = '.jsonl.gz'
+
+
+def enabled() -> bool:
+    return bool(settings.RIDES_SNAPSHOT_DIR)
+
+
+@contextmanager
+def _locked(directory: str):
+    """
+    Holds exclusive lock on the snapshot directory, so many workers can append to the same files.
+    """
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, LOCK_FILE), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _stream_name(title: str, routing_key: str) -> str:
+    return f'{title}.{routing_key}'
+
+
+def _segment_path(directory: str, stream: str) -> str:
+    """
+    Returns path of segment the next chunk of given stream is appended to. Segments are rotated every day
+    and when they exceed RIDES_SNAPSHOT_SEGMENT_BYTES.
+    """
+    day = datetime.datetime.now(tz=datetime.timezone.utc).strftime('%Y%m%d')
+    number = 0
+    while True:
+        path = os.path.join(directory, f'{stream}-{day}-{number:04d}{SEGMENT_SUFFIX}')
+        if not os.path.exists(path) or os.path.getsize(path) < settings.RIDES_SNAPSHOT_SEGMENT_BYTES:
+            return path
+        number += 1
+
+
+def write_chunk(title: str, routing_key: str, rides: list) -> None:
+    """
+    Appends chunk of serialised rides to the snapshot of given event stream, if RIDES_SNAPSHOT_DIR is set.
+    Every chunk is written as a separate gzip member with one ride per line, so segment files stay valid
+    when writing is interrupted. Position of the chunk and range of its ride ids is appended to the index file.
+
+    :param title: event title
+    :param routing_key: routing key the rides are published to
+    :param rides: list of serialised rides
+    """
+    if not enabled() or not rides:
+        return
+
+    directory = settings.RIDES_SNAPSHOT_DIR
+    stream = _stream_name(title, routing_key)
+    lines = ''.join(json.dumps(ride, cls=DjangoJSONEncoder) + '\n' for ride in rides)
+    member = gzip.compress(lines.encode())
+    ride_ids = [ride['ride_id'] for ride in rides]
+
+    with _locked(directory):
+        path = _segment_path(directory, stream)
+        with open(path, 'ab') as segment:
+            offset = segment.tell()
+            segment.write(member)
+            segment.flush()
+            os.fsync(segment.fileno())
+
+        entry = {'stream': stream, 'segment': os.path.basename(path), 'offset': offset, 'length': len(member),
+                 'first_ride_id': min(ride_ids), 'last_ride_id': max(ride_ids), 'count': len(rides),
+                 'written_at': datetime.datetime.now(tz=datetime.timezone.utc).isoformat()}
+        with open(os.path.join(directory, INDEX_FILE), 'a') as index:
+            index.write(json.dumps(entry) + '\n')
+
+
+def index_entries(title: str, routing_key: str, first_ride_id: int or None = None,
+                  last_ride_id: int or None = None):
+    """
+    Returns index entries of chunks from given event stream that contain rides from given range.
+    """
+    path = os.path.join(settings.RIDES_SNAPSHOT_DIR, INDEX_FILE)
+    if not os.path.exists(path):
+        return
+    stream = _stream_name(title, routing_key)
+    with open(path) as index:
+        for line in index:
+            entry = json.loads(line)
+            if entry['stream'] != stream:
+                continue
+            if first_ride_id is not None and entry['last_ride_id'] < first_ride_id:
+                continue
+            if last_ride_id is not None and entry['first_ride_id'] > last_ride_id:
+                continue
+            yield entry
+
+
+def read_rides(title: str, routing_key: str, first_ride_id: int or None = None, last_ride_id: int or None = None):
+    """
+    Reads serialised rides of given event stream from snapshot files, without touching the database.
+    Only chunks pointed by the index are decompressed. Rides are returned in the order they were written,
+    a ride written more than once (ex. archived and then synced again) is returned every time.
+
+    :param title: event title
+    :param routing_key: routing key the rides were published to
+    :param first_ride_id: first ride id of the range or None
+    :param last_ride_id: last ride id of the range or None
+    :return: generator of serialised rides
+    """
+    directory = settings.RIDES_SNAPSHOT_DIR
+    for entry in index_entries(title, routing_key, first_ride_id, last_ride_id):
+        with open(os.path.join(directory, entry['segment']), 'rb') as segment:
+            segment.seek(entry['offset'])
+            member = segment.read(entry['length'])
+        for line in gzip.decompress(member).splitlines():
+            ride = json.loads(line)
+            if first_ride_id is not None and ride['ride_id'] < first_ride_id:
+                continue
+            if last_ride_id is not None and ride['ride_id'] > last_ride_id:
+                continue
+            yield ride
+
+
+def read_chunks(title: str, routing_key: str, chunk_size: int, first_ride_id: int or None = None,
+                last_ride_id: int or None = None):
+    """
+    Reads rides from snapshot like read_rides, grouped in lists with at most chunk_size rides.
+    """
+    chunk = []
+    for ride in read_rides(title, routing_key, first_ride_id, last_ride_id):
+        chunk.append(ride)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
@@ -1,33 +1,233 @@
+import hashlib
+import json
+import logging
 import os
-from functools import wraps
+import threading
+import time
+import urllib.request
+from collections import OrderedDict
 
 import jwt
-from django.http import JsonResponse
-from rest_framework import status
+from django.conf import settings
+from jwt import PyJWKSet
+from jwt.algorithms import RSAAlgorithm
 
 from users.models import User
+from utils.metrics import increment
 
+logger = logging.getLogger(__name__)
+
+_keys_lock = threading.Lock()
+_keys = OrderedDict()
+MAX_CACHED_KEYS = 4
+
+
+def public_key():
+    """
+    Returns public key used to verify tokens. Key is parsed once and cached by its content, so changed TOKEN_KEY
+    (key rotation) is loaded on the next request without restarting the process.
+    """
+    key_material = os.environ.get("TOKEN_KEY")
+    with _keys_lock:
+        key = _keys.get(key_material)
+        if key is not None:
+            _keys.move_to_end(key_material)
+            return key
+
+    pem = f"""-----BEGIN PUBLIC KEY-----\n{key_material}\n-----END PUBLIC KEY-----"""
+    key = RSAAlgorithm(RSAAlgorithm.SHA256).prepare_key(pem)
+    increment('auth.key_cache.load')
+    with _keys_lock:
+        _keys[key_material] = key
+        while len(_keys) > MAX_CACHED_KEYS:
+            _keys.popitem(last=False)
+    return key
 
-def validate_token(func):
-    @wraps(func)
-    def inner(self, request, *args, **kwargs):
-        try:
-            token = request.headers['Authorization'].split(' ')[1]
-        except (KeyError, IndexError):
-            return JsonResponse(data='Invalid token provided', status=status.HTTP_401_UNAUTHORIZED, safe=False)
 
+class KeySet:
+    """
+    Set of public keys loaded from JWKS document (file path or HTTP URL) and selected by token 'kid' header.
+    Keys are parsed once per load. Keys older than TOKEN_JWKS_REFRESH_INTERVAL are still used while the set is
+    reloaded in background thread (stale-while-revalidate). Token with unknown 'kid' is rejected right away
+    and triggers background reload, at most once per TOKEN_JWKS_MIN_REFRESH_INTERVAL, so no request waits
+    for the fetch. Only the first load, when there are no keys yet, is done in the request. Concurrent requests
+    wait for it instead of being rejected, and after a failed first load the next request tries again right away.
+    """
+
+    def __init__(self, source: str):
+        self.source = source
+        self.lock = threading.Lock()
+        self.initial_load_lock = threading.Lock()
+        self.initial_loads = 0
+        self.keys = None
+        self.loaded_at = 0.0
+        self.refresh_started_at = None
+        self.refreshing = False
+
+    def fetch(self) -> dict:
+        if self.source.startswith(('http://', 'https://')):
+            with urllib.request.urlopen(self.source, timeout=5) as response:
+                data = json.load(response)
+        else:
+            with open(self.source) as jwks_file:
+                data = json.load(jwks_file)
+        return {jwk.key_id: jwk.key for jwk in PyJWKSet.from_dict(data).keys if jwk.public_key_use in (None, 'sig')}
+
+    def load(self) -> None:
         try:
-            public_key = f"""-----BEGIN PUBLIC KEY-----\n{os.environ.get("TOKEN_KEY")}\n-----END PUBLIC KEY-----"""
-            decoded_token = jwt.decode(token, public_key, algorithms=["RS256"], audience="account")
-        except jwt.exceptions.DecodeError:
-            return JsonResponse(data='Token decoding failure', status=status.HTTP_401_UNAUTHORIZED, safe=False)
+            keys = self.fetch()
+        except Exception:
+            logger.exception('Loading token keys from %s failed', self.source)
+            increment('auth.jwks.failure')
+            keys = None
+        with self.lock:
+            if keys is not None:
+                self.keys, self.loaded_at = keys, time.monotonic()
+                increment('auth.jwks.load')
+            self.refreshing = False
+
+    def start_refresh(self, min_interval: float) -> bool:
+        """
+        Marks reload as started, unless one is running or the last one started less than min_interval seconds ago.
+        """
+        now = time.monotonic()
+        with self.lock:
+            if self.refreshing or (self.refresh_started_at is not None and now - self.refresh_started_at < min_interval):
+                return False
+            self.refreshing, self.refresh_started_at = True, now
+            return True
+
+    def refresh(self, min_interval: float) -> None:
+        if self.start_refresh(min_interval):
+            threading.Thread(target=self.load, daemon=True).start()
+
+    def load_initial(self) -> None:
+        """
+        Loads keys in the request when there are none yet. Requests waiting for a load in progress use its result
+        and do not fetch again when it failed.
+        """
+        attempt = self.initial_loads
+        with self.initial_load_lock:
+            if self.keys is None and self.initial_loads == attempt:
+                self.load()
+                self.initial_loads += 1
+
+    def get(self, kid: str or None):
+        """
+        Returns key with given id, if token has no 'kid' the only key from the set is returned.
+
+        :raises jwt.exceptions.DecodeError: when the key is unknown
+        """
+        if self.keys is None:
+            self.load_initial()
+        keys = self.keys or {}
+
+        if time.monotonic() - self.loaded_at > settings.TOKEN_JWKS_REFRESH_INTERVAL:
+            self.refresh(min_interval=settings.TOKEN_JWKS_MIN_REFRESH_INTERVAL)
+
+        if kid is None and len(keys) == 1:
+            return next(iter(keys.values()))
+        key = keys.get(kid)
+        if key is None:
+            increment('auth.jwks.unknown_kid')
+            self.refresh(min_interval=settings.TOKEN_JWKS_MIN_REFRESH_INTERVAL)
+            raise jwt.exceptions.DecodeError(f'Unknown token key {kid}')
+        return key
+
+
+_key_sets_lock = threading.Lock()
+_key_sets = {}
+
 
-        user_email = decoded_token['email']
+def key_set(source: str) -> KeySet:
+    with _key_sets_lock:
+        if source not in _key_sets:
+            _key_sets[source] = KeySet(source)
+        return _key_sets[source]
+
+
+class TokenCache:
+    """
+    Bounded cache of verified tokens and ids of users they belong to. Tokens are kept by their hash for at most
+    TOKEN_CACHE_TTL seconds and never after their expiration time, the least recently used tokens are removed
+    when there are more than TOKEN_CACHE_SIZE of them. Only user ids are cached, users are updated by the users
+    consumer running in other processes, so cached User objects would get stale.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tokens = OrderedDict()
+
+    @staticmethod
+    def key(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, token: str) -> int or None:
+        key = self.key(token)
+        with self.lock:
+            cached = self.tokens.get(key)
+            if cached is not None:
+                expires_at, user_id = cached
+                if expires_at > time.time():
+                    self.tokens.move_to_end(key)
+                    increment('auth.token_cache.hit')
+                    return user_id
+                del self.tokens[key]
+        increment('auth.token_cache.miss')
+        return None
+
+    def set(self, token: str, decoded_token: dict, user_id: int) -> None:
+        expires_at = time.time() + settings.TOKEN_CACHE_TTL
+        if 'exp' in decoded_token:
+            expires_at = min(expires_at, decoded_token['exp'])
+        key = self.key(token)
+        with self.lock:
+            self.tokens[key] = (expires_at, user_id)
+            self.tokens.move_to_end(key)
+            while len(self.tokens) > settings.TOKEN_CACHE_SIZE:
+                self.tokens.popitem(last=False)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.tokens.clear()
+
+
+token_cache = TokenCache()
+
+
+def verification_key(token: str):
+    """
+    Returns key for token verification, from TOKEN_JWKS key set selected by token 'kid' header if it is set,
+    otherwise the single TOKEN_KEY.
+    """
+    if settings.TOKEN_JWKS:
+        return key_set(settings.TOKEN_JWKS).get(jwt.get_unverified_header(token).get('kid'))
+    return public_key()
+
+
+def decode_token(token: str) -> dict:
+    return jwt.decode(token, verification_key(token), algorithms=["RS256"], audience="account")
+
+
+def resolve_user(token: str) -> User:
+    """
+    Verifies token and returns user it belongs to. Verified tokens are cached (see TokenCache), user of cached
+    token is read by primary key, so changes of the user are visible right away.
+
+    :param token: bearer token
+    :raises jwt.exceptions.DecodeError: when token cannot be verified
+    :raises User.DoesNotExist: when there is no user with email from the token
+    :return: user the token belongs to
+    """
+    user_id = token_cache.get(token)
+    if user_id is not None:
         try:
-            user = User.objects.get(email=user_email)
+            return User.objects.get(pk=user_id)
         except User.DoesNotExist:
-            return JsonResponse(status=status.HTTP_404_NOT_FOUND, data="User not found", safe=False)
-
-        return func(self, request, user=user, *args, **kwargs)
+            # user was deleted, the token is verified again
+            pass
 
-    return inner
+    decoded_token = decode_token(token)
+    user = User.objects.get(email=decoded_token['email'])
+    token_cache.set(token, decoded_token, user.pk)
+    return user
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.1 on 2026-10-19 13:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vehicles', '0004_alter_vehicle_user'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vehicle',
+            name='sync_hash',
+            field=models.CharField(blank=True, default='', max_length=40),
+        ),
+    ]
@@ -10,3 +10,4 @@ class Vehicle(models.Model):
     color = models.CharField(max_length=20)
     user = models.ForeignKey(User, related_name='vehicles', on_delete=models.CASCADE, blank=False, null=True)
     # default is temporary
+    sync_hash = models.CharField(max_length=40, blank=True, default="")